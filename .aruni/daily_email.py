@@ -5,19 +5,38 @@ Aruni Daily Email - Sends review reminders to all users.
 Reads learning data, finds concepts due for review, sends HTML emails.
 Run manually:  python3 daily_email.py
 Run for one:   python3 daily_email.py varnika
+
+Nightly, after the last session of the day, precompute tomorrow's due lists
+into the `digest` tab so the morning send is one read plus the emails:
+               python3 daily_email.py digest build [username] [YYYY-MM-DD]
+
+Benchmark email rendering on synthetic digests:
+               python3 daily_email.py bench [users]
 """
 
 import os
 import sys
 import json
+import asyncio
 import smtplib
+from html import escape
+from string import Template
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
 ADMIN_DIR = os.path.dirname(os.path.abspath(__file__))
 ARUNI_DIR = os.path.dirname(ADMIN_DIR)   # parent = repo root
+sys.path.insert(0, ARUNI_DIR)
+
+from aruni import (AsyncSheets, ConceptTable, DIGEST_HEADERS, apply_catalog, catalog_index, count, digest_row,
+                   group_by_shard, load_credentials, parse_digest_row, shard_ids, timed, to_records,
+                   track_command)
+
+# Gmail throttles parallel SMTP logins from one account
+SMTP_CONCURRENCY = 4
+
 
 def load_env():
     env_path = os.path.join(ARUNI_DIR, '.env')
@@ -35,121 +54,289 @@ def log(msg):
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
 
 
-def get_sheet():
-    import gspread
-    from google.oauth2.service_account import Credentials
-    scopes = ['https://www.googleapis.com/auth/spreadsheets']
+def get_async_client():
     creds_path = os.environ.get('ARUNI_KEY_PATH', os.path.join(ARUNI_DIR, '.aruni.key'))
-    if not os.path.isabs(creds_path):
-        creds_path = os.path.join(ARUNI_DIR, creds_path)
-    creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
-    gc = gspread.authorize(creds)
-    return gc.open_by_key(os.environ['ARUNI_DB'])
-
-
-def get_due_concepts(sh, username):
-    """Get concepts due for review today from a user's tab"""
-    ws = sh.worksheet(username)
-    rows = ws.get_all_records()
-    today = datetime.now().strftime('%Y-%m-%d')
-    due = []
-    for r in rows:
-        nr = str(r.get('next_review', ''))
-        if nr and nr <= today:
-            due.append({
-                'topic': r.get('topic', ''),
-                'question': r.get('questions', ''),
-                'confidence': r.get('confidence', 'Low'),
-                'times_reviewed': r.get('times_reviewed', 0)
-            })
-    return due
-
-
-def build_review_email(name, domain, concepts):
-    today_display = datetime.now().strftime('%A, %B %d, %Y')
-    colors = {'Low': '#e74c3c', 'Medium': '#f39c12', 'High': '#27ae60'}
-
-    questions_html = ''
-    for i, c in enumerate(concepts, 1):
-        color = colors.get(c['confidence'], '#95a5a6')
-        questions_html += f'''
-        <div style="background:#f8f9fa;padding:16px;border-radius:8px;margin:12px 0;border-left:4px solid {color};">
-            <strong>{i}. {c['topic']}</strong>
-            <span style="background:{color};color:white;padding:2px 8px;border-radius:3px;font-size:12px;margin-left:8px;">{c['confidence']}</span>
-            <br><br>{c['question'] or '(no question set)'}
-            <br><small style="color:#999;">Reviewed {c['times_reviewed']} time(s)</small>
-        </div>'''
-
-    return f'''<div style="font-family:Arial,sans-serif;max-width:600px;margin:0 auto;padding:20px;color:#333;">
-        <h2 style="color:#2c3e50;border-bottom:2px solid #3498db;padding-bottom:8px;">Your Daily Review</h2>
-        <p style="color:#666;">{today_display}</p>
-        <p>Good morning {name}! You have <strong>{len(concepts)}</strong> concept(s) in <strong>{domain}</strong> ready for review.</p>
-        <h3>Answer from memory (no peeking!):</h3>
-        {questions_html}
-        <div style="background:#e3f2fd;padding:16px;border-radius:8px;margin:24px 0;text-align:center;">
-            <p style="margin:0;">Open your LLM and say: <strong>"I'm ready to review"</strong></p>
-        </div>
-        <hr style="border:none;border-top:1px solid #eee;margin:24px 0;">
-        <p style="font-size:11px;color:#aaa;text-align:center;">Aruni Learning System</p>
-    </div>'''
-
-
-def build_no_due_email(name, domain):
+    return AsyncSheets(load_credentials(creds_path))
+
+
+def due_concepts(values, for_date=None, catalog=None):
+    """Concepts due on `for_date` (default today) from a tab's raw values"""
+    table = apply_catalog(ConceptTable.from_values(values), catalog or {})
+    return [{
+        'topic': table.topic[i],
+        'question': table.questions[i],
+        'confidence': table.confidence_of(i) or 'Low',
+        'times_reviewed': table.times_reviewed[i]
+    } for i in table.due(for_date)]
+
+
+def digest_concepts(digest):
+    """Due list from a digest row, in the shape due_concepts returns"""
+    return [{
+        'topic': topic,
+        'question': question,
+        'confidence': confidence or 'Low',
+        'times_reviewed': times
+    } for _, confidence, times, topic, question in digest['due']]
+
+
+def read_digests(values, for_date):
+    """All usable digest rows for `for_date` from a digest tab's values, keyed by username"""
+    digests = {}
+    for row in (values or [])[1:]:
+        d = parse_digest_row(row)
+        if d is not None and d['for_date'] == for_date.isoformat():
+            digests[d['user']] = d
+    return digests
+
+
+async def read_shard_ids(client, sheet_id):
+    return shard_ids(await client.values(sheet_id, 'shards') or [])
+
+
+def build_digests(for_date=None, only_user=None):
+    """Snapshot every learner's due list for `for_date` (default: tomorrow) into their shard's digest tab"""
+    for_date = for_date or date.today() + timedelta(days=1)
+    sheet_id = os.environ['ARUNI_DB']
+
+    async def run():
+        async with get_async_client() as client:
+            config = to_records(await client.values(sheet_id, 'config') or [])
+            if only_user:
+                config = [u for u in config if u.get('user') == only_user]
+            groups = group_by_shard(config)
+            written = await asyncio.gather(*(
+                build_shard_digest(client, shard_id or sheet_id, users, for_date, bool(only_user))
+                for shard_id, users in groups.items()))
+            return sum(written), len(groups)
+
+    written, shards = asyncio.run(run())
+    log(f"Done. {written} digest row(s) written for {for_date.isoformat()} across {shards} shard(s).")
+
+
+async def build_shard_digest(client, spreadsheet_id, users, for_date, keep_others):
+    """Rewrite one shard's digest tab; returns the number of rows built"""
+    usernames = [u.get('user', '') for u in users if u.get('user')]
+    tabs, existing, catalog = await asyncio.gather(client.batch_values(spreadsheet_id, usernames),
+                                                   client.values(spreadsheet_id, 'digest'),
+                                                   client.values(spreadsheet_id, 'catalog'))
+    catalog = catalog_index(catalog or [])
+    if existing is None:
+        await client.add_sheet(spreadsheet_id, 'digest', rows=max(len(users) + 1, 10),
+                               cols=len(DIGEST_HEADERS))
+    # A single-user rebuild keeps everyone else's row; a full build starts clean
+    rows = {}
+    if keep_others and existing:
+        rows = {r[0]: r for r in existing[1:] if r and r[0]}
+
+    built = 0
+    for user in users:
+        username = user.get('user', '')
+        if tabs.get(username) is None:
+            log(f"  ERROR reading tab '{username}': not found")
+            continue
+        table = apply_catalog(ConceptTable.from_values(tabs[username]), catalog)
+        rows[username] = digest_row(user, table, for_date)
+        built += 1
+        log(f"Digest {username}: {rows[username][7]} due on {for_date.isoformat()}")
+
+    await client.replace_values(spreadsheet_id, 'digest', [DIGEST_HEADERS] + list(rows.values()))
+    return built
+
+
+# ---------------------------------------------------------------------------
+# Rendering
+# ---------------------------------------------------------------------------
+
+# Templates are compiled once; a message is built by joining pre-escaped
+# parts, so rendering is linear in the number of cards. Styles live in one
+# <style> block instead of being repeated on every card.
+EMAIL_MAX_CARDS    = 25       # cards shown in full; the rest are summarized
+EMAIL_MAX_QUESTION = 400      # characters of each question shown
+EMAIL_SIZE_LIMIT   = 90000    # Gmail clips HTML bodies over ~102KB
+
+LEVEL_CLASS = {'Low': 'lo', 'Medium': 'md', 'High': 'hi'}
+
+EMAIL_CSS = (
+    'body{margin:0}'
+    '.w{font-family:Arial,sans-serif;max-width:600px;margin:0 auto;padding:20px;color:#333}'
+    'h2{color:#2c3e50;border-bottom:2px solid #3498db;padding-bottom:8px}h2.ok{color:#27ae60;border:0}'
+    '.d{color:#666}'
+    '.c{background:#f8f9fa;padding:16px;border-radius:8px;margin:12px 0;border-left:4px solid #95a5a6}'
+    '.b{background:#95a5a6;color:#fff;padding:2px 8px;border-radius:3px;font-size:12px;margin-left:8px}'
+    '.c.lo{border-color:#e74c3c}.b.lo{background:#e74c3c}'
+    '.c.md{border-color:#f39c12}.b.md{background:#f39c12}'
+    '.c.hi{border-color:#27ae60}.b.hi{background:#27ae60}'
+    '.c small{color:#999}'
+    '.cta{background:#e3f2fd;padding:16px;border-radius:8px;margin:24px 0;text-align:center}'
+    '.idea{background:#e8f5e9;padding:16px;border-radius:8px;margin:20px 0}'
+    'hr{border:none;border-top:1px solid #eee;margin:24px 0}'
+    '.f{font-size:11px;color:#aaa;text-align:center}'
+)
+
+PAGE_HTML = Template(
+    '<!DOCTYPE html><html><head><meta charset="utf-8"><style>$css</style></head>'
+    '<body><div class="w">$body<hr><p class="f">Aruni Learning System</p></div></body></html>')
+
+REVIEW_HTML = Template(
+    '<h2>Your Daily Review</h2><p class="d">$today</p>'
+    '<p>Good morning $name! You have <strong>$count</strong> concept(s) in <strong>$domain</strong> ready for review.</p>'
+    '<h3>Answer from memory (no peeking!):</h3>$cards$more'
+    '<div class="cta"><p style="margin:0">Open your LLM and say: <strong>"I\'m ready to review"</strong></p></div>')
+
+CARD_HTML = Template(
+    '<div class="c $level"><strong>$n. $topic</strong><span class="b $level">$confidence</span>'
+    '<br><br>$question<br><small>Reviewed $times time(s)</small></div>')
+
+MORE_HTML = Template('<p>&hellip;and <strong>$count</strong> more ($breakdown). Your LLM will go through all of them.</p>')
+
+NO_DUE_HTML = Template(
+    '<h2 class="ok">All caught up!</h2><p class="d">$today</p>'
+    '<p>$name, no concepts due for review today in <strong>$domain</strong>.</p>'
+    '<div class="idea"><p><strong>Ideas for today:</strong></p><ul>'
+    '<li>Open your LLM and say <strong>"Teach me something new"</strong></li>'
+    '<li>Read something and discuss it with your LLM</li>'
+    '<li>Ask a question you\'ve been curious about</li></ul></div>')
+
+REVIEW_TEXT = Template(
+    'Your Daily Review - $today\n\n'
+    'Good morning $name! You have $count concept(s) in $domain ready for review.\n\n'
+    'Answer from memory (no peeking!):\n\n$cards$more\n'
+    'Open your LLM and say: "I\'m ready to review"\n\n-- \nAruni Learning System\n')
+
+CARD_TEXT = Template('$n. $topic [$confidence]\n   $question\n   Reviewed $times time(s)\n\n')
+
+NO_DUE_TEXT = Template(
+    'All caught up! - $today\n\n'
+    '$name, no concepts due for review today in $domain.\n\n'
+    'Ideas for today:\n'
+    '  - Open your LLM and say "Teach me something new"\n'
+    '  - Read something and discuss it with your LLM\n'
+    '  - Ask a question you\'ve been curious about\n\n-- \nAruni Learning System\n')
+
+
+def _clip(text, limit):
+    text = str(text)
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '\u2026'
+
+
+def _more_breakdown(concepts):
+    counts = {}
+    for c in concepts:
+        counts[c['confidence']] = counts.get(c['confidence'], 0) + 1
+    return ', '.join(f"{n} {level}" for level, n in sorted(counts.items(), key=lambda kv: -kv[1]))
+
+
+def render_review_email(name, domain, concepts, today_display=None, max_cards=EMAIL_MAX_CARDS):
+    """(html, text) for a learner with due concepts; long lists are cut to max_cards and summarized"""
+    today_display = today_display or datetime.now().strftime('%A, %B %d, %Y')
+    while True:
+        shown, rest = concepts[:max_cards], concepts[max_cards:]
+        html_cards, text_cards = [], []
+        for i, c in enumerate(shown, 1):
+            topic = str(c['topic'])
+            question = _clip(c['question'] or '(no question set)', EMAIL_MAX_QUESTION)
+            confidence = c['confidence']
+            html_cards.append(CARD_HTML.substitute(
+                level=LEVEL_CLASS.get(confidence, ''), n=i, topic=escape(topic),
+                confidence=escape(confidence), question=escape(question), times=c['times_reviewed']))
+            text_cards.append(CARD_TEXT.substitute(
+                n=i, topic=topic, confidence=confidence, question=question, times=c['times_reviewed']))
+        more_html = more_text = ''
+        if rest:
+            breakdown = _more_breakdown(rest)
+            more_html = MORE_HTML.substitute(count=len(rest), breakdown=escape(breakdown))
+            more_text = f"...and {len(rest)} more ({breakdown}). Your LLM will go through all of them.\n"
+
+        fields = {'today': today_display, 'count': len(concepts)}
+        html = PAGE_HTML.substitute(css=EMAIL_CSS, body=REVIEW_HTML.substitute(
+            fields, name=escape(name), domain=escape(domain), cards=''.join(html_cards), more=more_html))
+        if len(html) <= EMAIL_SIZE_LIMIT or max_cards <= 1:
+            break
+        max_cards //= 2
+    text = REVIEW_TEXT.substitute(fields, name=name, domain=domain, cards=''.join(text_cards), more=more_text)
+    return html, text
+
+
+def render_no_due_email(name, domain, today_display=None):
+    """(html, text) for a learner with nothing due"""
+    today_display = today_display or datetime.now().strftime('%A, %B %d, %Y')
+    html = PAGE_HTML.substitute(css=EMAIL_CSS, body=NO_DUE_HTML.substitute(
+        today=today_display, name=escape(name), domain=escape(domain)))
+    return html, NO_DUE_TEXT.substitute(today=today_display, name=name, domain=domain)
+
+
+def bench_render(users=500, seed=7):
+    """Render synthetic digests for `users` learners and report time and message sizes"""
+    import random, time
+    rng = random.Random(seed)
+    levels = ['Low', 'Low', 'Medium', 'High']
+    digests = []
+    for u in range(users):
+        # Mostly small due lists, with a long tail of learners back from a break
+        n = int(rng.paretovariate(1.2)) * 3 if rng.random() < 0.9 else rng.randint(100, 600)
+        digests.append((f'Learner {u} <{u}>', 'Energy & "Markets"', [{
+            'topic': f'Concept {i} & <friends>',
+            'question': 'Why does ' + 'capacity ' * rng.randint(5, 120) + 'matter?',
+            'confidence': rng.choice(levels),
+            'times_reviewed': rng.randint(0, 8)} for i in range(n)]))
+
     today_display = datetime.now().strftime('%A, %B %d, %Y')
-    return f'''<div style="font-family:Arial,sans-serif;max-width:600px;margin:0 auto;padding:20px;color:#333;">
-        <h2 style="color:#27ae60;">All caught up!</h2>
-        <p style="color:#666;">{today_display}</p>
-        <p>{name}, no concepts due for review today in <strong>{domain}</strong>.</p>
-        <div style="background:#e8f5e9;padding:16px;border-radius:8px;margin:20px 0;">
-            <p><strong>Ideas for today:</strong></p>
-            <ul>
-                <li>Open your LLM and say <strong>"Teach me something new"</strong></li>
-                <li>Read something and discuss it with your LLM</li>
-                <li>Ask a question you've been curious about</li>
-            </ul>
-        </div>
-        <p style="font-size:11px;color:#aaa;text-align:center;">Aruni Learning System</p>
-    </div>'''
-
-
-def send_email(to_email, subject, html_body, sender_email, app_password):
+    start = time.perf_counter()
+    sizes = []
+    for name, domain, concepts in digests:
+        if concepts:
+            html, text = render_review_email(name, domain, concepts, today_display)
+        else:
+            html, text = render_no_due_email(name, domain, today_display)
+        sizes.append(len(html) + len(text))
+    elapsed = time.perf_counter() - start
+
+    cards = sum(len(c) for _, _, c in digests)
+    print(f"Rendered {users} digests ({cards} due cards) in {elapsed * 1000:.1f} ms "
+          f"({elapsed / users * 1e6:.0f} us/user)")
+    print(f"Message size: max {max(sizes) / 1024:.1f} KB, mean {sum(sizes) / len(sizes) / 1024:.1f} KB "
+          f"(HTML limit {EMAIL_SIZE_LIMIT / 1024:.0f} KB)")
+
+
+def send_email(to_email, subject, html_body, text_body, sender_email, app_password):
     msg = MIMEMultipart('alternative')
     msg['Subject'] = subject
     msg['From'] = formataddr(('Aruni', sender_email))
     msg['To'] = to_email
-    msg.attach(MIMEText(html_body, 'html'))
+    # Clients show the last part they can render, so plain text goes first
+    msg.attach(MIMEText(text_body, 'plain', 'utf-8'))
+    msg.attach(MIMEText(html_body, 'html', 'utf-8'))
 
     with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
         server.login(sender_email, app_password)
         server.send_message(msg)
 
 
-def process_user(sh, username, name, email, domain, sender_email, app_password):
+def process_user(username, name, email, domain, sender_email, app_password, concepts):
     log(f"Processing {username} ({email})...")
 
-    try:
-        concepts = get_due_concepts(sh, username)
-    except Exception as e:
-        log(f"  ERROR reading tab '{username}': {e}")
-        return False
-
     if concepts:
         subject = f"{len(concepts)} concept(s) to review - {domain}"
-        body = build_review_email(name, domain, concepts)
+        html, text = render_review_email(name, domain, concepts)
     else:
         subject = f"All caught up! - {domain}"
-        body = build_no_due_email(name, domain)
+        html, text = render_no_due_email(name, domain)
 
     try:
-        send_email(email, subject, body, sender_email, app_password)
+        with timed('aruni_email_send_seconds'):
+            send_email(email, subject, html, text, sender_email, app_password)
         log(f"  Sent to {email}: {len(concepts)} concepts due")
+        count('aruni_emails_total', result='sent')
         return True
     except smtplib.SMTPAuthenticationError:
         log(f"  ERROR: Gmail auth failed. Check GMAIL_APP_PASSWORD in .env")
         log(f"  Generate one at: https://myaccount.google.com/apppasswords")
+        count('aruni_emails_total', result='auth_failed')
         return False
     except Exception as e:
         log(f"  ERROR sending to {email}: {e}")
+        count('aruni_emails_total', result='failed')
         return False
 
 
@@ -169,28 +356,80 @@ def main():
         print("ERROR: SENDER_EMAIL not set in .env")
         sys.exit(1)
 
-    sh = get_sheet()
-    config = sh.worksheet('config').get_all_records()
+    sheet_id = os.environ['ARUNI_DB']
 
     # Filter to specific user if provided
     only_user = sys.argv[1] if len(sys.argv) > 1 else None
 
-    sent = 0
-    for user in config:
-        username = user.get('user', '')
-        if only_user and username != only_user:
-            continue
-        name = user.get('name', username)
-        email = user.get('email', '')
-        domain = user.get('domain', '')
-        if not email:
-            log(f"Skipping {username}: no email")
-            continue
-        if process_user(sh, username, name, email, domain, sender_email, app_password):
-            sent += 1
-
+    sent = asyncio.run(send_all(sheet_id, only_user, sender_email, app_password))
     log(f"Done. {sent} email(s) sent.")
 
 
+async def send_all(sheet_id, only_user, sender_email, app_password):
+    """Read due lists for every shard concurrently, then send; returns emails sent"""
+    async with get_async_client() as client:
+        # Last night's digests have everything needed to send, so this is one
+        # read per shard plus config. Learners without a usable digest row
+        # (added since the build, unreadable then, or a due list too big to
+        # store) get a batched read of their live tabs instead.
+        shards, config = await asyncio.gather(read_shard_ids(client, sheet_id),
+                                              client.values(sheet_id, 'config'))
+        users = [u for u in to_records(config or []) if u.get('user')]
+        if only_user:
+            users = [u for u in users if u.get('user') == only_user]
+        digests = {}
+        for values in await asyncio.gather(*(client.values(s or sheet_id, 'digest') for s in shards)):
+            digests.update(read_digests(values, date.today()))
+
+        concepts = {u['user']: digest_concepts(digests[u['user']]) for u in users if u['user'] in digests}
+        live = [u for u in users if u['user'] not in digests]
+        if live:
+            log(f"No digest for today for {len(live)} learner(s), reading their tabs directly")
+
+            async def read_group(shard_id, group):
+                return await asyncio.gather(client.batch_values(shard_id, [u['user'] for u in group]),
+                                            client.values(shard_id, 'catalog'))
+            groups = group_by_shard(live)
+            for tabs, catalog in await asyncio.gather(*(read_group(s or sheet_id, g) for s, g in groups.items())):
+                catalog = catalog_index(catalog or [])
+                for username, values in tabs.items():
+                    if values is None:
+                        log(f"  ERROR reading tab '{username}': not found")
+                    else:
+                        concepts[username] = due_concepts(values, catalog=catalog)
+
+        smtp_limit = asyncio.Semaphore(SMTP_CONCURRENCY)
+
+        async def send(user):
+            username = user.get('user', '')
+            name = user.get('name', username)
+            email = user.get('email', '')
+            domain = user.get('domain', '')
+            if not email:
+                log(f"Skipping {username}: no email")
+                return False
+            if username not in concepts:
+                return False
+            async with smtp_limit:
+                return await client.run(process_user, username, name, email, domain,
+                                        sender_email, app_password, concepts[username])
+
+        return sum(await asyncio.gather(*(send(u) for u in users)))
+
+
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] == ['bench']:
+        bench_render(int(sys.argv[2]) if len(sys.argv) > 2 else 500)
+    elif sys.argv[1:3] == ['digest', 'build']:
+        load_env()
+        only_user, for_date = None, None
+        for arg in sys.argv[3:]:
+            try:
+                for_date = date.fromisoformat(arg)
+            except ValueError:
+                only_user = arg
+        with track_command('daily_email', 'digest-build'):
+            build_digests(for_date, only_user)
+    else:
+        with track_command('daily_email', 'send'):
+            main()
@@ -18,6 +18,10 @@
  *   8. Done! Emails will be sent every morning automatically.
  *
  * TEST: Click Run > sendDailyEmails to send a test email now.
+ *
+ * SHARDS: learners routed to another spreadsheet (setup.py add-shard) are read
+ * from that spreadsheet, so share each shard with the account that owns this
+ * script. Without access their emails are skipped and the error is logged.
  */
 
 // Data store reference (admin-managed)
@@ -35,47 +39,34 @@ function sendDailyEmails() {
   var configData = configSheet.getDataRange().getValues();
   var today = Utilities.formatDate(new Date(), Session.getScriptTimeZone(), 'yyyy-MM-dd');
   var todayDisplay = Utilities.formatDate(new Date(), Session.getScriptTimeZone(), 'EEEE, MMMM d, yyyy');
+  var shards = {};   // shard id ('' = this spreadsheet) -> {ss, digests, catalog}
 
   // Skip header row
   for (var i = 1; i < configData.length; i++) {
+    // user, name, email, domain, learning_goal, joined_at, custom_instructions, shard
     var username = configData[i][0];
     var name = configData[i][1];
     var email = configData[i][2];
     var domain = configData[i][3];
+    var shardId = String(configData[i][7] || '').trim();
 
     if (!username || !email) continue;
 
     try {
-      var userSheet = ss.getSheetByName(username);
-      if (!userSheet) {
-        Logger.log('No tab found for user: ' + username);
-        continue;
+      // Learners live in the spreadsheet named by their config row's shard
+      // (setup.py add-user routes them); each one is opened once per run
+      var shard = shards[shardId];
+      if (!shard) {
+        var shardSs = (shardId && shardId !== ARUNI_SHEET_ID) ? SpreadsheetApp.openById(shardId) : ss;
+        shard = shards[shardId] = { ss: shardSs, digests: readDigests(shardSs, today), catalog: null };
       }
 
-      var data = userSheet.getDataRange().getValues();
-      if (data.length <= 1) continue; // Only headers
-
-      // Find concepts due for review (next_review <= today)
-      var dueConcepts = [];
-      for (var j = 1; j < data.length; j++) {
-        var nextReview = data[j][6]; // Column G: next_review
-        if (!nextReview) continue;
-
-        var reviewDate;
-        if (nextReview instanceof Date) {
-          reviewDate = Utilities.formatDate(nextReview, Session.getScriptTimeZone(), 'yyyy-MM-dd');
-        } else {
-          reviewDate = nextReview.toString();
-        }
-
-        if (reviewDate <= today) {
-          dueConcepts.push({
-            topic: data[j][0],       // A: topic
-            question: data[j][3],    // D: questions
-            confidence: data[j][4] || 'Low',  // E: confidence
-            timesReviewed: data[j][7] || 0     // H: times_reviewed
-          });
-        }
+      // Prefer last night's digest (daily_email.py digest build); scan the tab otherwise
+      var dueConcepts = shard.digests[username];
+      if (!dueConcepts) {
+        if (shard.catalog === null) shard.catalog = readCatalogQuestions(shard.ss);
+        dueConcepts = scanDueConcepts(shard.ss, username, today, shard.catalog);
+        if (dueConcepts === null) continue;
       }
 
       // Generate and send email
@@ -104,6 +95,86 @@ function sendDailyEmails() {
 }
 
 
+/**
+ * Due lists from the `digest` tab that were built for today, keyed by username.
+ * Rows whose due list was too large to store are left out so the caller scans.
+ */
+function readDigests(ss, today) {
+  var digests = {};
+  var digestSheet = ss.getSheetByName('digest');
+  if (!digestSheet) return digests;
+
+  var data = digestSheet.getDataRange().getDisplayValues();
+  for (var i = 1; i < data.length; i++) {
+    // user, for_date, built_at, name, email, domain, total, due_count, due
+    if (data[i][1] !== today) continue;
+    if (!data[i][8] && data[i][7] !== '0') continue;
+    var entries = data[i][8] ? JSON.parse(data[i][8]) : [];
+    digests[data[i][0]] = entries.map(function(e) {
+      return { topic: e[3], question: e[4], confidence: e[1] || 'Low', timesReviewed: e[2] || 0 };
+    });
+  }
+  return digests;
+}
+
+
+/**
+ * Questions from the shared `catalog` tab (ARUNI_CATALOG=shared), keyed by the
+ * `cat:<key>` reference that learner rows keep in column C.
+ */
+function readCatalogQuestions(ss) {
+  var questions = {};
+  var catalogSheet = ss.getSheetByName('catalog');
+  if (!catalogSheet) return questions;
+
+  var data = catalogSheet.getDataRange().getValues();
+  for (var i = 1; i < data.length; i++) {
+    // key, domain, topic, explanation, question, created_at
+    if (data[i][0]) questions['cat:' + data[i][0]] = data[i][4];
+  }
+  return questions;
+}
+
+
+/**
+ * Concepts due on or before today, read directly from the user's tab.
+ * Returns null when the tab is missing or has only headers.
+ */
+function scanDueConcepts(ss, username, today, catalog) {
+  var userSheet = ss.getSheetByName(username);
+  if (!userSheet) {
+    Logger.log('No tab found for user: ' + username);
+    return null;
+  }
+
+  var data = userSheet.getDataRange().getValues();
+  if (data.length <= 1) return null; // Only headers
+
+  var dueConcepts = [];
+  for (var j = 1; j < data.length; j++) {
+    var nextReview = data[j][7]; // Column H: next_review
+    if (!nextReview) continue;
+
+    var reviewDate;
+    if (nextReview instanceof Date) {
+      reviewDate = Utilities.formatDate(nextReview, Session.getScriptTimeZone(), 'yyyy-MM-dd');
+    } else {
+      reviewDate = nextReview.toString();
+    }
+
+    if (reviewDate <= today) {
+      dueConcepts.push({
+        topic: data[j][0],       // A: topic
+        question: data[j][3] || catalog[data[j][2]] || '',    // D: questions, or the catalog's
+        confidence: data[j][4] || 'Low',  // E: confidence
+        timesReviewed: data[j][8] || 0     // I: times_reviewed
+      });
+    }
+  }
+  return dueConcepts;
+}
+
+
 function buildReviewEmail(name, domain, todayDisplay, concepts) {
   var colors = { 'Low': '#e74c3c', 'Medium': '#f39c12', 'High': '#27ae60' };
 
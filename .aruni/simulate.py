@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""
+Aruni workload simulator - capacity planning for a cohort.
+
+Replays synthetic learners (add rate, accuracy, session frequency) over a
+simulated calendar and reports due cards, Sheets API calls and emails per
+day, and peak load per learner. Reviews are scheduled by aruni.py's own
+schedule_review(), and each action is charged the API calls the real command
+makes, measured at startup by running due, session-start, update, add and
+session-end against an in-memory spreadsheet.
+
+Run:  python3 simulate.py [--learners 1000] [--days 365] [--start YYYY-MM-DD]
+                          [--add-rate 3] [--accuracy 0.8] [--sessions 4]
+                          [--max-reviews 60] [--seed 1] [--exact 1] [--json out.json]
+
+  --add-rate     new concepts per session (mean)
+  --accuracy     mean share of reviews answered correctly
+  --sessions     sessions per week (mean)
+  --max-reviews  cards a learner gets through in one session before stopping
+  --exact        run every action through the real commands (slow; for checking
+                 the fast model on a small cohort, which gives the same numbers)
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import math
+import random
+import time
+from array import array
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+
+ADMIN_DIR = os.path.dirname(os.path.abspath(__file__))
+ARUNI_DIR = os.path.dirname(ADMIN_DIR)   # parent = repo root
+sys.path.insert(0, ARUNI_DIR)
+
+import aruni
+from aruni import BATCH_GET_RANGES, ROLLUP_HEADERS, schedule_review
+from setup import KB_HEADERS, SESSIONS_HEADERS, SHARD_CAPACITY
+
+DEFAULTS = {'learners': 1000, 'days': 365, 'start': '', 'add_rate': 3.0, 'accuracy': 0.8,
+            'sessions': 4.0, 'max_reviews': 60, 'seed': 1, 'exact': 0, 'json': ''}
+
+
+# ---------------------------------------------------------------------------
+# Simulated clock
+# ---------------------------------------------------------------------------
+
+# aruni.py reads the time through date.today() and datetime.now(); the
+# simulator swaps in subclasses that answer from this clock instead.
+CLOCK = [datetime(2026, 1, 1)]
+
+
+class SimDate(date):
+    @classmethod
+    def today(cls):
+        return CLOCK[0].date()
+
+
+class SimDateTime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return CLOCK[0]
+
+    @classmethod
+    def today(cls):
+        return CLOCK[0]
+
+
+# ---------------------------------------------------------------------------
+# In-memory backend
+# ---------------------------------------------------------------------------
+
+class Cell:
+    __slots__ = ('row', 'col')
+
+    def __init__(self, row, col):
+        self.row, self.col = row, col
+
+
+class MemoryBook:
+    """Just enough of a gspread Spreadsheet for the learner commands; counts API calls."""
+
+    def __init__(self):
+        self.tabs = {}
+        self.calls = 0
+
+    def worksheet(self, title):
+        import gspread
+        self.calls += 1
+        if title not in self.tabs:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return self.tabs[title]
+
+    def add_worksheet(self, title, rows=1000, cols=26):
+        self.calls += 1
+        ws = self.tabs[title] = MemorySheet(self, title)
+        return ws
+
+    def values_get(self, range_name):
+        # Only the missing-tab case is needed: the simulation never builds digests
+        import gspread
+        self.calls += 1
+        title = range_name.rsplit('!', 1)[0].strip("'")
+        if title not in self.tabs:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return {'values': []}
+
+
+class MemorySheet:
+    """One tab. Rows are stored as lists of strings, the way Sheets returns them."""
+
+    def __init__(self, book, title, rows=None):
+        self.book, self.title, self.rows = book, title, rows or []
+
+    def get_all_values(self):
+        self.book.calls += 1
+        return self.rows    # callers only read, so no copy
+
+    def row_values(self, row):
+        self.book.calls += 1
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def col_values(self, col):
+        self.book.calls += 1
+        return [r[col - 1] if len(r) >= col else '' for r in self.rows]
+
+    def find(self, query, in_column=None):
+        self.book.calls += 1
+        for i, r in enumerate(self.rows):
+            if in_column and len(r) >= in_column and r[in_column - 1] == query:
+                return Cell(i + 1, in_column)
+        return None
+
+    def update_cell(self, row, col, value):
+        self.book.calls += 1
+        r = self._row(row)
+        r.extend([''] * (col - len(r)))
+        r[col - 1] = str(value)
+
+    def update(self, values, range_name='A1'):
+        self.book.calls += 1
+        start = int(re.sub(r'\D', '', range_name) or 1)
+        for k, values_row in enumerate(values):
+            self._row(start + k)[:] = [str(v) for v in values_row]
+
+    def append_row(self, values, **kwargs):
+        self.book.calls += 1
+        self.rows.append([str(v) for v in values])
+        n = len(self.rows)
+        return {'updates': {'updatedRange': f"'{self.title}'!A{n}:I{n}"}}
+
+    def _row(self, row):
+        while len(self.rows) < row:
+            self.rows.append([])
+        return self.rows[row - 1]
+
+
+class DueCounter:
+    """Running count of cards due as of `today`, kept up to date as next_review dates move."""
+
+    def __init__(self):
+        self.pending = {}      # next_review ordinal -> cards not yet due
+        self.due_now = 0
+        self.today = 0
+
+    def move(self, old, new):
+        if old:
+            if old <= self.today:
+                self.due_now -= 1
+            else:
+                self.pending[old] -= 1
+        if new <= self.today:
+            self.due_now += 1
+        else:
+            self.pending[new] = self.pending.get(new, 0) + 1
+
+    def advance(self, day):
+        """Roll the count forward to `day` (an ordinal)."""
+        days = range(self.today + 1, day + 1) if self.today else [d for d in self.pending if d <= day]
+        for d in days:
+            self.due_now += self.pending.pop(d, 0)
+        self.today = day
+
+
+class ConceptSheet(MemorySheet):
+    """A learner's tab that feeds next_review changes into a DueCounter."""
+
+    def __init__(self, book, title, rows, counter):
+        super().__init__(book, title, rows)
+        self.counter = counter
+
+    def update_cell(self, row, col, value):
+        if col == 8:
+            r = self.rows[row - 1]
+            old = date.fromisoformat(r[7]).toordinal() if len(r) > 7 and r[7] else 0
+            self.counter.move(old, date.fromisoformat(str(value)).toordinal())
+        super().update_cell(row, col, value)
+
+    def append_row(self, values, **kwargs):
+        if len(values) > 7 and values[7]:
+            self.counter.move(0, date.fromisoformat(str(values[7])).toordinal())
+        return super().append_row(values, **kwargs)
+
+
+# ---------------------------------------------------------------------------
+# Drivers
+# ---------------------------------------------------------------------------
+
+# A driver carries out a learner's actions. CommandDriver runs the real
+# commands end to end; ModelDriver keeps card state in flat arrays, schedules
+# with the same schedule_review() and charges each action the API calls the
+# real command made during calibrate(). Both give identical results for the
+# same seed; the model is what makes a 1,000-learner year run in seconds.
+
+EXPLANATION = 'A synthetic explanation of about the length a learner writes. ' * 6
+QUESTION    = 'Explain the idea in your own words?'
+
+LEARNERS = {}    # username -> CommandDriver, for the patched connect()
+CACHE = {}       # stands in for .aruni/cache on the learner's machine
+
+
+def run(fn, *args):
+    buf = io.StringIO()
+    with redirect_stdout(buf):
+        fn(*(str(a) for a in args))
+    return buf.getvalue()
+
+
+class CommandDriver:
+    def __init__(self, username):
+        self.username = username
+        self.counter = DueCounter()
+        self.book = MemoryBook()
+        self.book.tabs['sessions'] = MemorySheet(self.book, 'sessions', [list(SESSIONS_HEADERS)])
+        self.book.tabs['rollups'] = MemorySheet(self.book, 'rollups', [list(ROLLUP_HEADERS)])
+        self.ws = self.book.tabs[username] = ConceptSheet(self.book, username, [list(KB_HEADERS)], self.counter)
+        LEARNERS[username] = self
+
+    @property
+    def calls(self):
+        return self.book.calls
+
+    def cards(self):
+        return len(self.ws.rows) - 1
+
+    def due(self):
+        return [int(r) for r in re.findall(r'row=(\d+)', run(aruni.cmd_due, self.username))]
+
+    def start(self):
+        return int(re.search(r'row=(\d+)', run(aruni.cmd_session_start, self.username, 'Simulation')).group(1))
+
+    def review(self, row, correct):
+        run(aruni.cmd_update, self.username, row, 'correct' if correct else 'wrong')
+
+    def add(self, topic):
+        run(aruni.cmd_add, self.username, topic, 'Simulation', EXPLANATION, QUESTION)
+
+    def end(self, session_row, topics):
+        run(aruni.cmd_session_end, self.username, session_row, ', '.join(topics), '')
+
+
+class ModelDriver:
+    def __init__(self, costs):
+        self.costs = costs
+        self.calls = 0
+        self.counter = DueCounter()
+        self.next_review = array('l')
+        self.times = array('l')
+        self.confidence = []
+        self.sessions = 0
+
+    def cards(self):
+        return len(self.times)
+
+    def due(self):
+        self.calls += self.costs['due']
+        t = CLOCK[0].toordinal()
+        return [i + 2 for i, d in enumerate(self.next_review) if 0 < d <= t]
+
+    def start(self):
+        self.calls += self.costs['start']
+        self.sessions += 1
+        return self.sessions + 1
+
+    def review(self, row, correct):
+        self.calls += self.costs['update']
+        i = row - 2
+        times = self.times[i] + 1
+        confidence, days = schedule_review(times, self.confidence[i], correct)
+        new = CLOCK[0].toordinal() + days
+        self.counter.move(self.next_review[i], new)
+        self.next_review[i], self.times[i], self.confidence[i] = new, times, confidence
+
+    def add(self, topic):
+        self.calls += self.costs['add']
+        new = CLOCK[0].toordinal() + 1
+        self.counter.move(0, new)
+        self.next_review.append(new)
+        self.times.append(0)
+        self.confidence.append('Low')
+
+    def end(self, session_row, topics):
+        # The first session-end appends the learner's rollup row; later ones update it
+        self.calls += self.costs['end' if self.sessions > 1 else 'first end']
+
+
+def calibrate():
+    """API calls each command makes once a learner's tabs exist, measured on the real commands."""
+    CACHE.clear()
+    driver = CommandDriver('calibration')
+    costs = {}
+
+    def measure(name, fn, *args):
+        before = driver.calls
+        result = fn(*args)
+        costs[name] = driver.calls - before
+        return result
+
+    for day in (1, 2):    # day 1's session-end appends the rollups row; day 2 is steady state
+        CLOCK[0] = datetime(2026, 1, day, 9)
+        rows = measure('due', driver.due)
+        session_row = measure('start', driver.start)
+        for row in rows:
+            measure('update', driver.review, row, True)
+        measure('add', driver.add, f'Concept {day}')
+        measure('first end' if day == 1 else 'end', driver.end, session_row, ['Concept'])
+    del LEARNERS['calibration']
+    return costs
+
+
+# ---------------------------------------------------------------------------
+# Learners
+# ---------------------------------------------------------------------------
+
+class Learner:
+    def __init__(self, username, rng, opts, driver):
+        self.username = username
+        self.rng = rng
+        self.driver = driver
+        # Each learner gets their own habits around the cohort means
+        mean = min(max(opts['accuracy'], 0.01), 0.99)
+        self.accuracy = rng.betavariate(mean * 8, (1 - mean) * 8)
+        self.session_p = min(1.0, rng.gammavariate(4, opts['sessions'] / 4) / 7)
+        self.add_rate = opts['add_rate'] * rng.uniform(0.5, 1.5)
+        self.max_reviews = opts['max_reviews']
+        self.added = 0
+
+    def poisson(self, mean):
+        # Knuth's method; means here are small
+        limit, k, p = math.exp(-mean), 0, 1.0
+        while True:
+            p *= self.rng.random()
+            if p <= limit:
+                return k
+            k += 1
+
+    def session(self, day):
+        """One study session on `day`: due, session-start, reviews, adds, session-end."""
+        rng, driver = self.rng, self.driver
+        CLOCK[0] = datetime.combine(day, datetime.min.time()) + timedelta(hours=rng.randint(7, 21))
+        rows = driver.due()[:self.max_reviews]
+        session_row = driver.start()
+        for row in rows:
+            CLOCK[0] += timedelta(minutes=rng.randint(1, 3))
+            driver.review(row, rng.random() < self.accuracy)
+        topics = []
+        for _ in range(self.poisson(self.add_rate)):
+            CLOCK[0] += timedelta(minutes=rng.randint(2, 6))
+            self.added += 1
+            topics.append(f'Concept {self.added}')
+            driver.add(topics[-1])
+        CLOCK[0] += timedelta(minutes=2)
+        driver.end(session_row, topics)
+        return len(rows), len(topics)
+
+
+def install():
+    """Point aruni.py at the simulated clock, the in-memory books and an in-memory cache."""
+    aruni.date, aruni.datetime = SimDate, SimDateTime
+
+    def connect(username):
+        driver = LEARNERS[username]
+        driver.book.calls += 2     # open_by_key + worksheet lookup
+        return driver.book, driver.ws
+
+    aruni.connect = connect
+    aruni.read_cache = lambda name, default=None: CACHE.get(name, default)
+    aruni.write_cache = CACHE.__setitem__
+    aruni.blobs_enabled = lambda: False
+    aruni.catalog_enabled = lambda: False
+    aruni.start_prefetch = lambda username: None
+
+
+# ---------------------------------------------------------------------------
+# Simulation
+# ---------------------------------------------------------------------------
+
+def email_job_calls(n_learners):
+    """Sheets calls for one night's `digest build` plus the morning send."""
+    capacity = int(os.environ.get('ARUNI_SHARD_CAPACITY', SHARD_CAPACITY))   # as setup.py's pick_shard reads it
+    shards = max(1, math.ceil(n_learners / capacity))
+    # build: config, then per shard the batched tab reads, the digest and catalog reads, clear + write
+    build = 1 + sum(math.ceil(min(capacity, n_learners - s * capacity) / BATCH_GET_RANGES) + 4
+                    for s in range(shards))
+    send = 2 + shards    # shards and config tabs, then one digest read per shard
+    return build + send
+
+
+def simulate(opts):
+    start = date.fromisoformat(opts['start']) if opts['start'] else date.today()
+    days = opts['days']
+    install()
+    costs = calibrate()
+    daily = [{'date': (start + timedelta(days=d)).isoformat(), 'due': 0, 'review_emails': 0,
+              'sessions': 0, 'reviews': 0, 'adds': 0, 'api_calls': 0, 'peak_learner_calls': 0,
+              'peak_learner_due': 0} for d in range(days)]
+    peak_calls, peak_due, final_cards = [], [], []
+
+    # Learners don't share state, so each is run through the whole calendar in
+    # turn; only one learner's cards are in memory at a time.
+    for n in range(opts['learners']):
+        LEARNERS.clear()
+        CACHE.clear()
+        username = f'learner{n}'
+        driver = CommandDriver(username) if opts['exact'] else ModelDriver(costs)
+        learner = Learner(username, random.Random(opts['seed'] * 1000003 + n), opts, driver)
+        most_calls = most_due = 0
+        for d in range(days):
+            day = start + timedelta(days=d)
+            driver.counter.advance(day.toordinal())
+            stats = daily[d]
+            due = driver.counter.due_now
+            stats['due'] += due
+            stats['review_emails'] += due > 0
+            stats['peak_learner_due'] = max(stats['peak_learner_due'], due)
+            most_due = max(most_due, due)
+            if learner.rng.random() < learner.session_p:
+                before = driver.calls
+                reviews, adds = learner.session(day)
+                calls = driver.calls - before
+                stats['sessions'] += 1
+                stats['reviews'] += reviews
+                stats['adds'] += adds
+                stats['api_calls'] += calls
+                stats['peak_learner_calls'] = max(stats['peak_learner_calls'], calls)
+                most_calls = max(most_calls, calls)
+        peak_calls.append(most_calls)
+        peak_due.append(most_due)
+        final_cards.append(driver.cards())
+
+    email_calls = email_job_calls(opts['learners'])
+    for stats in daily:
+        stats['emails'] = opts['learners']
+        stats['email_job_calls'] = email_calls
+    return {'options': opts, 'costs': costs, 'daily': daily, 'peak_calls': peak_calls,
+            'peak_due': peak_due, 'final_cards': final_cards}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+def report(result, elapsed):
+    opts, daily = result['options'], result['daily']
+    print(f"Simulated {opts['learners']} learners x {opts['days']} days in {elapsed:.1f}s "
+          f"(add {opts['add_rate']}/session, accuracy {opts['accuracy']:.0%}, "
+          f"{opts['sessions']} sessions/week)")
+    print()
+    print(f"{'Week of':<12} {'Due/day':>9} {'Sessions':>9} {'Reviews':>9} {'Adds':>7} "
+          f"{'API/day':>9} {'Peak/lrnr':>10} {'Emails':>7}")
+    print("-" * 78)
+    for w in range(0, len(daily), 7):
+        week = daily[w:w + 7]
+        avg = lambda k: sum(s[k] for s in week) / len(week)
+        print(f"{week[0]['date']:<12} {avg('due'):>9.0f} {avg('sessions'):>9.0f} {avg('reviews'):>9.0f} "
+              f"{avg('adds'):>7.0f} {avg('api_calls') + avg('email_job_calls'):>9.0f} "
+              f"{max(s['peak_learner_calls'] for s in week):>10} {avg('emails'):>7.0f}")
+    print()
+    busiest = max(daily, key=lambda s: s['api_calls'])
+    print(f"Busiest day:            {busiest['date']}, {busiest['api_calls']} learner API calls, "
+          f"{busiest['due']} cards due")
+    print(f"Email job:              {daily[0]['email_job_calls']} API calls/day, {opts['learners']} emails/day")
+    peaks = result['peak_calls']
+    print(f"Peak calls per learner: median {percentile(peaks, 0.5)}, p95 {percentile(peaks, 0.95)}, "
+          f"max {max(peaks)} in one day")
+    due = result['peak_due']
+    print(f"Peak due per learner:   median {percentile(due, 0.5)}, p95 {percentile(due, 0.95)}, max {max(due)}")
+    cards = result['final_cards']
+    print(f"Cards per learner:      median {percentile(cards, 0.5)}, max {max(cards)} at the end")
+
+
+def parse_args(argv):
+    opts = dict(DEFAULTS)
+    rest = iter(argv)
+    for a in rest:
+        key = a[2:].replace('-', '_') if a.startswith('--') else None
+        if key not in opts:
+            print(__doc__.strip())
+            sys.exit(1)
+        value = next(rest, '')
+        opts[key] = type(DEFAULTS[key])(value) if DEFAULTS[key] != '' else value
+    return opts
+
+
+if __name__ == '__main__':
+    opts = parse_args(sys.argv[1:])
+    t0 = time.perf_counter()
+    result = simulate(opts)
+    report(result, time.perf_counter() - t0)
+    if opts['json']:
+        with open(opts['json'], 'w') as f:
+            json.dump(result, f)
+        print(f"Wrote {opts['json']}")
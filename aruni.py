@@ -9,12 +9,21 @@ Usage:
   python3 aruni.py session-start   <username> <domain>
   python3 aruni.py session-end     <username> <session_row> <topics_covered> <key_insights>
   python3 aruni.py status          <username>
+  python3 aruni.py forecast        <username> [days]
+  python3 aruni.py stats           <username>
+  python3 aruni.py context         <username> [--budget N] [--refresh 1]
+  python3 aruni.py show            <username> <row>
+  python3 aruni.py next            <username> [--limit N] [--cursor C]
+  python3 aruni.py prefetch        <username>
 """
 
-import os, sys
-from datetime import datetime, timedelta
+import os, re, sys, json, math, time, heapq, threading
+from array import array
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 
 ARUNI_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(ARUNI_DIR, '.aruni', 'cache')
 
 
 def load_config():
@@ -30,6 +39,7 @@ def load_config():
 
 
 def connect(username):
+    """Open the spreadsheet holding this learner's tab (their shard) and the tab itself."""
     import gspread
     from google.oauth2.service_account import Credentials
     cfg = load_config()
@@ -37,57 +47,1331 @@ def connect(username):
     db_id    = cfg.get('ARUNI_DB', '')
     creds = Credentials.from_service_account_file(
         key_path, scopes=['https://www.googleapis.com/auth/spreadsheets'])
-    gc = gspread.authorize(creds)
-    sh = gc.open_by_key(db_id)
-    ws = sh.worksheet(username)
+    gc = instrument(gspread.authorize(creds))
+
+    routes = read_cache('routes', {})
+    primary = None
+    if username not in routes:
+        primary = gc.open_by_key(db_id)
+        routes = refresh_routes(primary)
+    shard = routes.get(username) or ''
+    sh = primary if primary and not shard else gc.open_by_key(shard or db_id)
+    try:
+        ws = sh.worksheet(username)
+    except gspread.exceptions.WorksheetNotFound:
+        if primary:
+            raise
+        # Cached route is stale (learner moved shards) — re-read config once
+        primary = sh if not shard else gc.open_by_key(db_id)
+        shard = refresh_routes(primary).get(username) or ''
+        sh = primary if not shard else gc.open_by_key(shard)
+        ws = sh.worksheet(username)
     return sh, ws
 
 
+# ---------------------------------------------------------------------------
+# Shards
+# ---------------------------------------------------------------------------
+
+# Learners are spread over several spreadsheets to stay under the
+# per-spreadsheet cell limit and quotas. ARUNI_DB (the primary) holds the
+# config tab, whose `shard` column is the routing map: the spreadsheet ID
+# holding that learner's tab, blank meaning the primary. Every shard has its
+# own sessions and digest tabs. Shards other than the primary are listed in
+# the primary's `shards` tab.
+SHARDS_HEADERS = ['shard_id', 'title', 'created_at']
+
+
+def shard_of(user):
+    """Shard ID for a config row ('' = primary)."""
+    return str(user.get('shard', '') or '').strip()
+
+
+def refresh_routes(primary):
+    """Re-read the routing map from config and cache it locally."""
+    routes = {u.get('user', ''): shard_of(u) for u in primary.worksheet('config').get_all_records()}
+    write_cache('routes', routes)
+    return routes
+
+
+def shard_ids(values):
+    """All shard IDs from the shards tab's values, primary ('') first."""
+    return [''] + [r[0] for r in values[1:] if r and r[0]]
+
+
+def list_shards(primary):
+    try:
+        values = primary.worksheet('shards').get_all_values()
+    except Exception:
+        values = []
+    return shard_ids(values)
+
+
+def open_shard(gc, primary, shard_id):
+    """Spreadsheet for a shard ID. `gc` is the gspread Client that opened the primary
+    (in gspread 6 `primary.client` is only the HTTP client, which cannot open sheets)."""
+    return primary if not shard_id or shard_id == primary.id else gc.open_by_key(shard_id)
+
+
+def group_by_shard(users):
+    """Config rows grouped by shard ID, preserving order within each shard."""
+    groups = {}
+    for u in users:
+        groups.setdefault(shard_of(u), []).append(u)
+    return groups
+
+
+# ---------------------------------------------------------------------------
+# Async Sheets client (batch jobs)
+# ---------------------------------------------------------------------------
+
+SHEETS_API = 'https://sheets.googleapis.com/v4/spreadsheets'
+BATCH_GET_RANGES = 50    # tabs per values:batchGet call, keeps the URL short
+
+
+def load_credentials(key_path=None, scopes=('https://www.googleapis.com/auth/spreadsheets',)):
+    """Service account credentials from ARUNI_KEY_PATH (same key the CLI uses)."""
+    from google.oauth2.service_account import Credentials
+    if key_path is None:
+        key_path = load_config().get('ARUNI_KEY_PATH') or os.path.join(ARUNI_DIR, '.aruni.key')
+    if not os.path.isabs(key_path):
+        key_path = os.path.join(ARUNI_DIR, key_path)
+    return Credentials.from_service_account_file(key_path, scopes=list(scopes))
+
+
+def a1(tab, cells='A:Z'):
+    """A1 range for a whole tab, quoting the tab name."""
+    return "'" + tab.replace("'", "''") + "'!" + cells
+
+
+def _values_url(spreadsheet_id, tab, cells='A:Z'):
+    from urllib.parse import quote
+    return f"{SHEETS_API}/{spreadsheet_id}/values/{quote(a1(tab, cells), safe='')}"
+
+
+def to_records(values):
+    """Rows after the header as dicts keyed by header, like get_all_records()."""
+    if not values:
+        return []
+    header = values[0]
+    return [dict(zip(header, row + [''] * (len(header) - len(row)))) for row in values[1:] if any(row)]
+
+
+class AsyncSheets:
+    """Small asyncio client for the Sheets values API, used by the fan-out jobs.
+
+    Requests go through one google-auth AuthorizedSession, so connections are
+    pooled and reused, and at most `concurrency` are in flight at once. The
+    HTTP calls themselves run on a pool of that many threads. 429s and 5xx
+    responses are retried with exponential backoff.
+    """
+
+    def __init__(self, creds=None, concurrency=None):
+        from concurrent.futures import ThreadPoolExecutor
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+        import asyncio
+        self.concurrency = concurrency or int(os.environ.get('ARUNI_CONCURRENCY', 16))
+        self.session = instrument(AuthorizedSession(creds or load_credentials()))
+        self.session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=self.concurrency))
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.limit = asyncio.Semaphore(self.concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        self.session.close()
+
+    async def run(self, fn, *args):
+        """Run a blocking callable on the client's pool, within the concurrency limit."""
+        import asyncio
+        async with self.limit:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, lambda: fn(*args))
+
+    async def request(self, method, url, retries=5, **kwargs):
+        import asyncio, random
+        for attempt in range(retries + 1):
+            resp = await self.run(lambda: self.session.request(method, url, **kwargs))
+            if resp.status_code in (429, 500, 502, 503) and attempt < retries:
+                await asyncio.sleep(min(2 ** attempt, 32) + random.random())
+                continue
+            resp.raise_for_status()
+            return resp.json() if resp.content else {}
+
+    async def values(self, spreadsheet_id, tab, cells='A:Z'):
+        """All values of a tab, or None if the tab does not exist."""
+        import requests
+        try:
+            data = await self.request('GET', _values_url(spreadsheet_id, tab, cells))
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 400:
+                return None
+            raise
+        return data.get('values', [])
+
+    async def batch_values(self, spreadsheet_id, tabs, cells='A:Z'):
+        """{tab: values} for many tabs in as few calls as possible; missing tabs map to None."""
+        import asyncio, requests
+        tabs = list(tabs)
+
+        async def chunk(names):
+            try:
+                data = await self.request('GET', f'{SHEETS_API}/{spreadsheet_id}/values:batchGet',
+                                          params=[('ranges', a1(t, cells)) for t in names])
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 400:
+                    raise
+                if len(names) == 1:
+                    return {names[0]: None}
+                # One bad range fails the whole call — retry the tabs one by one
+                return dict(zip(names, await asyncio.gather(*(self.values(spreadsheet_id, t, cells) for t in names))))
+            return {t: vr.get('values', []) for t, vr in zip(names, data.get('valueRanges', []))}
+
+        result = {}
+        for part in await asyncio.gather(*(chunk(tabs[i:i + BATCH_GET_RANGES])
+                                           for i in range(0, len(tabs), BATCH_GET_RANGES))):
+            result.update(part)
+        return result
+
+    async def replace_values(self, spreadsheet_id, tab, values):
+        """Clear a tab and write `values` from A1."""
+        await self.request('POST', _values_url(spreadsheet_id, tab) + ':clear')
+        await self.request('PUT', _values_url(spreadsheet_id, tab, 'A1'),
+                           params={'valueInputOption': 'RAW'}, json={'values': values})
+
+    async def add_sheet(self, spreadsheet_id, title, rows=1000, cols=26):
+        await self.batch_update(spreadsheet_id, [
+            {'addSheet': {'properties': {'title': title,
+                                         'gridProperties': {'rowCount': rows, 'columnCount': cols}}}}])
+
+    async def batch_update(self, spreadsheet_id, requests):
+        """Several spreadsheet changes (addSheet, updateSheetProperties, ...) in one call."""
+        return await self.request('POST', f'{SHEETS_API}/{spreadsheet_id}:batchUpdate',
+                                  json={'requests': requests})
+
+    async def sheet_properties(self, spreadsheet_id):
+        """{title: properties} for every tab, in sheet order."""
+        data = await self.request('GET', f'{SHEETS_API}/{spreadsheet_id}',
+                                  params={'fields': 'sheets.properties'})
+        return {s['properties']['title']: s['properties'] for s in data.get('sheets', [])}
+
+    async def clear_ranges(self, spreadsheet_id, ranges):
+        await self.request('POST', f'{SHEETS_API}/{spreadsheet_id}/values:batchClear',
+                           json={'ranges': list(ranges)})
+
+    async def append_values(self, spreadsheet_id, tab, rows):
+        """Append rows after the last row of a tab in one call."""
+        await self.request('POST', _values_url(spreadsheet_id, tab) + ':append',
+                           params={'valueInputOption': 'RAW', 'insertDataOption': 'INSERT_ROWS'},
+                           json={'values': rows})
+
+    async def write_ranges(self, spreadsheet_id, data):
+        """Write several [{'range': ..., 'values': ...}] blocks in one values:batchUpdate call."""
+        await self.request('POST', f'{SHEETS_API}/{spreadsheet_id}/values:batchUpdate',
+                           json={'valueInputOption': 'RAW', 'data': data})
+
+
+# ---------------------------------------------------------------------------
+# Concept table
+# ---------------------------------------------------------------------------
+
+# cols: topic(1) domain(2) explanation(3) questions(4) confidence(5)
+#       created_at(6) last_reviewed(7) next_review(8) times_reviewed(9)
+CONFIDENCE_LEVELS = ('', 'Low', 'Medium', 'High')
+CONFIDENCE_CODES  = {c: i for i, c in enumerate(CONFIDENCE_LEVELS)}
+
+
+def _cell(row, i):
+    return row[i] if len(row) > i else ''
+
+
+class ConceptTable:
+    """Columnar view of a learner's tab, built from ws.get_all_values().
+
+    Blank rows are skipped, so the sheet row of index i is kept in `rows`
+    (use row_number). Dates are stored as ordinals (0 = blank) and
+    confidence as a one-byte code into CONFIDENCE_LEVELS, so the due/status
+    queries below are single passes over flat arrays instead of dict lookups.
+    Explanations are not kept — nothing that queries the table needs them.
+    """
+
+    __slots__ = ('rows', 'topic', 'domain', 'questions', 'confidence',
+                 'created', 'last_reviewed', 'next_review', 'times_reviewed')
+
+    def __init__(self):
+        self.rows           = array('l')
+        self.topic          = []
+        self.domain         = []
+        self.questions      = []
+        self.confidence     = bytearray()
+        self.created        = array('l')
+        self.last_reviewed  = array('l')
+        self.next_review    = array('l')
+        self.times_reviewed = array('l')
+
+    @classmethod
+    def from_values(cls, values):
+        """Build from raw sheet values (header row first)."""
+        t = cls()
+        ordinals = {'': 0}
+        def ordinal(s):
+            s = s[:10]
+            o = ordinals.get(s)
+            if o is None:
+                try:
+                    o = date.fromisoformat(s).toordinal()
+                except ValueError:
+                    o = 0
+                ordinals[s] = o
+            return o
+        domains = {}
+        codes = CONFIDENCE_CODES
+        for row_num, row in enumerate(values[1:], start=2):
+            if not any(row):
+                continue
+            t.rows.append(row_num)
+            t.topic.append(_cell(row, 0))
+            d = _cell(row, 1)
+            t.domain.append(domains.setdefault(d, d))
+            t.questions.append(_cell(row, 3) or (_cell(row, 2) if _cell(row, 2).startswith(CATALOG_PREFIX) else ''))
+            t.confidence.append(codes.get(_cell(row, 4), 0))
+            t.created.append(ordinal(_cell(row, 5)))
+            t.last_reviewed.append(ordinal(_cell(row, 6)))
+            t.next_review.append(ordinal(_cell(row, 7)))
+            n = _cell(row, 8)
+            try:
+                t.times_reviewed.append(int(n) if n else 0)
+            except ValueError:
+                t.times_reviewed.append(0)
+        return t
+
+    @classmethod
+    def from_worksheet(cls, ws):
+        return cls.from_values(ws.get_all_values())
+
+    def __len__(self):
+        return len(self.topic)
+
+    def due(self, today=None):
+        """Indices of concepts with next_review on or before today."""
+        t = (today or date.today()).toordinal()
+        return [i for i, d in enumerate(self.next_review) if 0 < d <= t]
+
+    def summary(self, today=None):
+        """(total, due, low, medium, high) for the status commands."""
+        t = (today or date.today()).toordinal()
+        due = sum(1 for d in self.next_review if 0 < d <= t)
+        c = self.confidence
+        return (len(self), due, c.count(CONFIDENCE_CODES['Low']),
+                c.count(CONFIDENCE_CODES['Medium']), c.count(CONFIDENCE_CODES['High']))
+
+    def forecast(self, days, today=None):
+        """Concepts coming due on each of the next `days` days; overdue ones count towards today."""
+        t = (today or date.today()).toordinal()
+        counts = [0] * days
+        for d in self.next_review:
+            if d:
+                k = d - t
+                if k < days:
+                    counts[max(k, 0)] += 1
+        return counts
+
+    def lapsed(self, i):
+        """Whether the last review was a miss. Misses reset confidence to Low with a
+        one-day interval; a correct answer after the first review never does both."""
+        return (self.times_reviewed[i] >= 2 and self.confidence[i] <= CONFIDENCE_CODES['Low']
+                and self.next_review[i] - self.last_reviewed[i] == 1)
+
+    def row_number(self, i):
+        return self.rows[i]
+
+    def confidence_of(self, i):
+        return CONFIDENCE_LEVELS[self.confidence[i]]
+
+
+# ---------------------------------------------------------------------------
+# Local cache and digest snapshots
+# ---------------------------------------------------------------------------
+
+def read_cache(name, default=None):
+    path = os.path.join(CACHE_DIR, name + '.json')
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_cache(name, data):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, name + '.json')
+    tmp = f'{path}.{os.getpid()}.tmp'    # the detached prefetch may be writing too
+    with open(tmp, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def mark_touched(username):
+    """Record that this learner's tab was read or changed today on this machine."""
+    write_cache(f'{username}.state', {'touched': date.today().isoformat()})
+
+
+# One row per learner, rebuilt nightly by `daily_email.py digest build`.
+# `due` is compact JSON: [[row, confidence, times_reviewed, topic, question], ...]
+DIGEST_HEADERS = ['user', 'for_date', 'built_at', 'name', 'email', 'domain', 'total', 'due_count', 'due']
+DIGEST_CELL_LIMIT = 45000   # Sheets caps a cell at 50,000 characters
+
+
+def digest_row(user, table, for_date):
+    """Snapshot of the cards `user` will have due on `for_date`."""
+    due = table.due(for_date)
+    entries = [[table.row_number(i), table.confidence_of(i) or 'Low', table.times_reviewed[i],
+                table.topic[i], table.questions[i]] for i in due]
+    payload = json.dumps(entries, separators=(',', ':'), ensure_ascii=False)
+    if len(payload) > DIGEST_CELL_LIMIT:
+        payload = ''    # too big for one cell; readers fall back to the live tab
+    username = user.get('user', '')
+    return [username, for_date.isoformat(), datetime.now().strftime('%Y-%m-%d %H:%M'),
+            user.get('name', username), user.get('email', ''), user.get('domain', ''),
+            len(table), len(due), payload]
+
+
+def parse_digest_row(row):
+    """Digest row as a dict, or None if its due list was not stored."""
+    d = dict(zip(DIGEST_HEADERS, row + [''] * (len(DIGEST_HEADERS) - len(row))))
+    if d['due'] == '' and str(d['due_count']) not in ('', '0'):
+        return None
+    d['due'] = json.loads(d['due']) if d['due'] else []
+    d['total'] = int(d['total'] or 0)
+    return d
+
+
+def read_digest(sh, username, for_date):
+    """This learner's digest for `for_date`, or None if there is no usable snapshot.
+
+    Reads only the learner's own row: the row number found last time is kept
+    in the local cache and checked, and only if it moved is column A read to
+    find it again.
+    """
+    def row_at(n):
+        values = sh.values_get(a1('digest', f'A{n}:{chr(64 + len(DIGEST_HEADERS))}{n}')).get('values', [])
+        return values[0] if values else []
+
+    try:
+        n = read_cache(f'{username}.digest_row')
+        row = row_at(n) if n else []
+        if _cell(row, 0) != username:
+            names = [_cell(r, 0) for r in sh.values_get(a1('digest', 'A:A')).get('values', [])]
+            if username not in names:
+                return None
+            n = names.index(username) + 1
+            write_cache(f'{username}.digest_row', n)
+            row = row_at(n)
+    except Exception:
+        return None
+    d = parse_digest_row(row)
+    if d is None or d['for_date'] != for_date.isoformat():
+        return None
+    return d
+
+
+def invalidate_digest(sh, username):
+    """Blank this learner's digest for_date after a change, so no machine serves the stale snapshot.
+
+    Uses the row number read_digest cached; if none is cached this machine has
+    never read the digest, and a wrong row only sends someone to their live tab.
+    """
+    n = read_cache(f'{username}.digest_row')
+    if not n:
+        return
+    try:
+        sh.values_update(a1('digest', f'B{n}'), params={'valueInputOption': 'RAW'}, body={'values': [['']]})
+    except Exception:
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Session rollups
+# ---------------------------------------------------------------------------
+
+# One fixed-size row per learner in their shard's `rollups` tab, folded
+# forward by session-end so stats never rescan the sessions tab.
+# `days` and `weeks` are JSON {key: [sessions, minutes, concepts]} holding
+# only the most recent ROLLUP_DAYS days and ROLLUP_WEEKS ISO weeks; `recent`
+# is [[date, topics, key_insights], ...] for the last ROLLUP_RECENT sessions.
+ROLLUP_HEADERS = ['user', 'updated_at', 'sessions', 'minutes', 'concepts',
+                  'streak', 'longest_streak', 'last_session', 'days', 'weeks', 'recent']
+ROLLUP_DAYS   = 14
+ROLLUP_WEEKS  = 12
+ROLLUP_RECENT = 5
+
+
+def week_key(day):
+    year, week, _ = day.isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def count_topics(topics_covered):
+    return len([t for t in topics_covered.replace(';', ',').split(',') if t.strip()])
+
+
+def empty_rollup(username):
+    return {'user': username, 'updated_at': '', 'sessions': 0, 'minutes': 0, 'concepts': 0,
+            'streak': 0, 'longest_streak': 0, 'last_session': '', 'days': {}, 'weeks': {}, 'recent': []}
+
+
+def parse_rollup_row(row):
+    row = list(row) + [''] * (len(ROLLUP_HEADERS) - len(row))
+    r = dict(zip(ROLLUP_HEADERS, row))
+    for k in ('sessions', 'minutes', 'concepts', 'streak', 'longest_streak'):
+        r[k] = int(r[k] or 0)
+    for k in ('days', 'weeks'):
+        r[k] = json.loads(r[k]) if r[k] else {}
+    r['recent'] = json.loads(r['recent']) if r['recent'] else []
+    return r
+
+
+def rollup_row(r):
+    return [r['user'], r['updated_at'], r['sessions'], r['minutes'], r['concepts'],
+            r['streak'], r['longest_streak'], r['last_session'],
+            json.dumps(r['days'], separators=(',', ':')), json.dumps(r['weeks'], separators=(',', ':')),
+            json.dumps(r['recent'], separators=(',', ':'), ensure_ascii=False)]
+
+
+def fold_session(r, day, minutes, concepts, topics='', insights=''):
+    """Add one finished session (on date `day`) to rollup `r` in place."""
+    minutes = max(int(minutes), 0)
+    r['sessions'] += 1
+    r['minutes']  += minutes
+    r['concepts'] += concepts
+
+    last = date.fromisoformat(r['last_session']) if r['last_session'] else None
+    if last is None or day > last:
+        r['streak'] = r['streak'] + 1 if last == day - timedelta(days=1) else 1
+        r['last_session'] = day.isoformat()
+    r['longest_streak'] = max(r['longest_streak'], r['streak'])
+
+    for bucket, key, keep in (('days', day.isoformat(), ROLLUP_DAYS), ('weeks', week_key(day), ROLLUP_WEEKS)):
+        agg = r[bucket].setdefault(key, [0, 0, 0])
+        agg[0] += 1
+        agg[1] += minutes
+        agg[2] += concepts
+        for old in sorted(r[bucket])[:-keep]:
+            del r[bucket][old]
+    if topics or insights:
+        r['recent'] = (r['recent'] + [[day.isoformat(), topics, insights]])[-ROLLUP_RECENT:]
+    r['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+    return r
+
+
+def current_streak(r, today=None):
+    """Streak as of today: it survives until a full day passes without a session."""
+    today = today or date.today()
+    if not r['last_session']:
+        return 0
+    return r['streak'] if date.fromisoformat(r['last_session']) >= today - timedelta(days=1) else 0
+
+
+def update_rollup(sh, username, day, minutes, topics, insights):
+    """Fold one session into the learner's rollup row (creating the tab/row if needed)."""
+    import gspread
+    try:
+        ws = sh.worksheet('rollups')
+    except gspread.exceptions.WorksheetNotFound:
+        ws = sh.add_worksheet('rollups', rows=100, cols=len(ROLLUP_HEADERS))
+        ws.update([ROLLUP_HEADERS], 'A1')
+    cell = ws.find(username, in_column=1)
+    r = parse_rollup_row(ws.row_values(cell.row)) if cell else empty_rollup(username)
+    fold_session(r, day, minutes, count_topics(topics), topics, insights)
+    if cell:
+        ws.update([rollup_row(r)], f'A{cell.row}')
+    else:
+        ws.append_row(rollup_row(r))
+    return r
+
+
+def read_rollup(sh, username):
+    try:
+        ws = sh.worksheet('rollups')
+        cell = ws.find(username, in_column=1)
+    except Exception:
+        return empty_rollup(username)
+    return parse_rollup_row(ws.row_values(cell.row)) if cell else empty_rollup(username)
+
+
+# ---------------------------------------------------------------------------
+# Explanation blobs
+# ---------------------------------------------------------------------------
+
+# With ARUNI_BLOBS=tab in .env, add and setup.py migrate store explanations
+# zlib-compressed in the shard's `blobs` tab, keyed by content hash, and put
+# only `blob:<hash>` in column C. Blobs never change, so once fetched they
+# are kept in .aruni/cache/blobs/ for good.
+BLOB_HEADERS = ['hash', 'size', 'data']
+BLOB_PREFIX  = 'blob:'
+BLOB_CELL_LIMIT = 45000
+
+
+def blobs_enabled():
+    return (os.environ.get('ARUNI_BLOBS') or load_config().get('ARUNI_BLOBS', '')).lower() == 'tab'
+
+
+def blob_ref(text):
+    import hashlib
+    return BLOB_PREFIX + hashlib.sha256(text.encode('utf-8')).hexdigest()[:20]
+
+
+def encode_blob(text):
+    import base64, zlib
+    return base64.b64encode(zlib.compress(text.encode('utf-8'), 9)).decode('ascii')
+
+
+def decode_blob(data):
+    import base64, zlib
+    return zlib.decompress(base64.b64decode(data)).decode('utf-8')
+
+
+def _blob_cache_path(ref):
+    return os.path.join(CACHE_DIR, 'blobs', ref[len(BLOB_PREFIX):])
+
+
+def _cache_blob(ref, text):
+    os.makedirs(os.path.join(CACHE_DIR, 'blobs'), exist_ok=True)
+    with open(_blob_cache_path(ref), 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def blobs_tab(sh):
+    import gspread
+    try:
+        return sh.worksheet('blobs')
+    except gspread.exceptions.WorksheetNotFound:
+        ws = sh.add_worksheet('blobs', rows=1000, cols=len(BLOB_HEADERS))
+        ws.update([BLOB_HEADERS], 'A1')
+        return ws
+
+
+def put_blobs(sh, texts):
+    """Store texts in the shard's blobs tab (skipping ones already there); returns the column C value for each.
+
+    Texts too large for one cell even compressed are returned unchanged and stay inline.
+    """
+    ws = blobs_tab(sh)
+    known = set(ws.col_values(1))
+    values, new_rows = [], []
+    for text in texts:
+        ref = blob_ref(text)
+        data = encode_blob(text)
+        if not text or len(data) > BLOB_CELL_LIMIT:
+            values.append(text)
+            continue
+        key = ref[len(BLOB_PREFIX):]
+        if key not in known:
+            known.add(key)
+            new_rows.append([key, len(text), data])
+        _cache_blob(ref, text)
+        values.append(ref)
+    if new_rows:
+        ws.append_rows(new_rows, value_input_option='RAW')
+    return values
+
+
+def put_blob(sh, text):
+    """Store one text: one read of the hash column, and an append if it is new."""
+    return put_blobs(sh, [text])[0]
+
+
+def resolve_text(sh, value):
+    """Column C value -> explanation text, fetching (and caching) the blob or catalog entry it refers to."""
+    if value.startswith(CATALOG_PREFIX):
+        value = catalog_entries(sh, [value]).get(value, (f"(missing catalog entry {value})", ''))[0]
+    if not value.startswith(BLOB_PREFIX):
+        return value
+    try:
+        with open(_blob_cache_path(value), encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        pass
+    # The hash column, then just the one row: never the other compressed texts
+    ws = sh.worksheet('blobs')
+    hashes = ws.col_values(1)
+    key = value[len(BLOB_PREFIX):]
+    if key not in hashes:
+        return f"(missing explanation {value})"
+    text = decode_blob(_cell(ws.row_values(hashes.index(key) + 1), 2))
+    _cache_blob(value, text)
+    return text
+
+
+def resolve_texts(sh, values):
+    """resolve_text for many values: at most one catalog read, and for uncached blobs one read of
+    the hash column plus one batched read of just their rows."""
+    entries = catalog_entries(sh, [v for v in values if v.startswith(CATALOG_PREFIX)])
+    values = [entries[v][0] if v in entries else v for v in values]
+    missing = set()
+    for value in values:
+        if value.startswith(BLOB_PREFIX) and not os.path.exists(_blob_cache_path(value)):
+            missing.add(value[len(BLOB_PREFIX):])
+    if missing:
+        ws = sh.worksheet('blobs')
+        rows = [n for n, key in enumerate(ws.col_values(1), start=1) if key in missing]
+        if rows:
+            for found in ws.batch_get([f'A{n}:C{n}' for n in rows]):
+                row = found[0] if found else []
+                if _cell(row, 0) in missing:
+                    _cache_blob(BLOB_PREFIX + row[0], decode_blob(_cell(row, 2)))
+    return [resolve_text(sh, value) for value in values]
+
+
+# ---------------------------------------------------------------------------
+# Shared catalog
+# ---------------------------------------------------------------------------
+
+# With ARUNI_CATALOG=shared in .env, add and setup.py migrate keep each
+# concept's explanation and question once per shard in a `catalog` tab, keyed
+# by normalized domain/topic. The learner's row keeps topic, domain and its
+# own scheduling columns, with `cat:<key>` in column C and column D blank.
+# A learner adding a concept someone in the shard already has reuses that
+# entry. Entries are never edited, so they are cached in .aruni/cache/catalog/.
+CATALOG_HEADERS = ['key', 'domain', 'topic', 'explanation', 'question', 'created_at']
+CATALOG_PREFIX  = 'cat:'
+
+
+def catalog_enabled():
+    return (os.environ.get('ARUNI_CATALOG') or load_config().get('ARUNI_CATALOG', '')).lower() == 'shared'
+
+
+def normalize_topic(text):
+    """Casefolded words joined by '-'. Letters, combining marks and digits of any
+    script are kept, so Devanagari topics stay distinct; text with none of them
+    (say, only punctuation) becomes a short hash of itself."""
+    import hashlib, unicodedata
+    text = unicodedata.normalize('NFKC', text).casefold()
+    words = ''.join(c if unicodedata.category(c)[0] in 'LMN' else ' ' for c in text).split()
+    if words or not text.strip():
+        return '-'.join(words)
+    return '#' + hashlib.sha256(text.strip().encode('utf-8')).hexdigest()[:12]
+
+
+def catalog_key(domain, topic):
+    topic_key = normalize_topic(topic)
+    if not topic_key:
+        raise ValueError("a concept needs a topic to go in the shared catalog")
+    return f"{normalize_topic(domain)}/{topic_key}"
+
+
+def _catalog_cache_path(ref):
+    import hashlib
+    return os.path.join(CACHE_DIR, 'catalog', hashlib.sha256(ref.encode('utf-8')).hexdigest()[:20])
+
+
+def _cache_entry(ref, explanation, question):
+    os.makedirs(os.path.join(CACHE_DIR, 'catalog'), exist_ok=True)
+    with open(_catalog_cache_path(ref), 'w', encoding='utf-8') as f:
+        json.dump([explanation, question], f)
+
+
+def catalog_tab(sh):
+    import gspread
+    try:
+        return sh.worksheet('catalog')
+    except gspread.exceptions.WorksheetNotFound:
+        ws = sh.add_worksheet('catalog', rows=1000, cols=len(CATALOG_HEADERS))
+        ws.update([CATALOG_HEADERS], 'A1')
+        return ws
+
+
+def put_catalog(sh, concepts):
+    """Add (domain, topic, explanation, question) entries to the shard's catalog, reusing any
+    with the same key; returns the `cat:` reference for each."""
+    ws = catalog_tab(sh)
+    known = set(ws.col_values(1))
+    now = datetime.now().strftime('%Y-%m-%d %H:%M')
+    refs, new = [], []
+    for domain, topic, explanation, question in concepts:
+        key = catalog_key(domain, topic)
+        if key not in known:
+            known.add(key)
+            new.append([key, domain, topic, explanation, question])
+        refs.append(CATALOG_PREFIX + key)
+    if new:
+        stored = put_blobs(sh, [r[3] for r in new]) if blobs_enabled() else [r[3] for r in new]
+        ws.append_rows([[key, domain, topic, text, question, now]
+                        for (key, domain, topic, _, question), text in zip(new, stored)],
+                       value_input_option='RAW')
+        for (key, _, _, _, question), text in zip(new, stored):
+            _cache_entry(CATALOG_PREFIX + key, text, question)
+    return refs
+
+
+def catalog_index(values):
+    """{`cat:` reference: (explanation, question)} from a catalog tab's values."""
+    return {CATALOG_PREFIX + row[0]: (_cell(row, 3), _cell(row, 4)) for row in values[1:] if row and row[0]}
+
+
+def catalog_entries(sh, refs):
+    """(explanation, question) for each `cat:` reference, with at most one read of the catalog tab.
+    Explanations may themselves be blob references."""
+    found, missing = {}, set()
+    for ref in set(refs):
+        try:
+            with open(_catalog_cache_path(ref), encoding='utf-8') as f:
+                found[ref] = tuple(json.load(f))
+        except (OSError, ValueError):
+            missing.add(ref)
+    if missing:
+        try:
+            index = catalog_index(sh.worksheet('catalog').get_all_values())
+        except Exception:
+            index = {}
+        for ref in missing & index.keys():
+            found[ref] = index[ref]
+            _cache_entry(ref, *index[ref])
+    return found
+
+
+def apply_catalog(table, index):
+    """Fill in questions for catalog-backed rows (ConceptTable keeps their `cat:` reference)."""
+    for i, q in enumerate(table.questions):
+        if q.startswith(CATALOG_PREFIX):
+            table.questions[i] = index.get(q, ('', ''))[1]
+    return table
+
+
+def resolve_questions(sh, table):
+    refs = [q for q in table.questions if q.startswith(CATALOG_PREFIX)]
+    return apply_catalog(table, catalog_entries(sh, refs)) if refs else table
+
+
+def expand_row(sh, row):
+    """A learner row with its explanation (and question, for catalog rows) resolved."""
+    row = list(row) + [''] * (9 - len(row))
+    if row[2].startswith(CATALOG_PREFIX) and not row[3]:
+        row[3] = catalog_entries(sh, [row[2]]).get(row[2], ('', ''))[1]
+    row[2] = resolve_text(sh, row[2])
+    return row
+
+
+# ---------------------------------------------------------------------------
+# Context pack
+# ---------------------------------------------------------------------------
+
+# A size-bounded summary of the learner's knowledge base for the LLM at
+# session start. Its inputs are cached in .aruni/cache/<user>.context.json
+# and patched in place by add/update/session-end; a full rebuild (one tab
+# read plus the rollup row) only happens when there is no cache or it is
+# older than CONTEXT_TTL. Concepts are [topic, domain, confidence code,
+# times_reviewed, next_review ordinal] keyed by sheet row.
+CONTEXT_TTL     = timedelta(hours=12)
+CONTEXT_BUDGET  = 1500    # tokens
+CHARS_PER_TOKEN = 4
+WEAK_LIMIT      = 10
+
+
+def build_context(table, rollup):
+    return {
+        'built_at': datetime.now().strftime('%Y-%m-%d %H:%M'),
+        'concepts': {str(table.row_number(i)): [table.topic[i], table.domain[i], table.confidence[i],
+                                                table.times_reviewed[i], table.next_review[i]]
+                     for i in range(len(table))},
+        'recent': rollup['recent'],
+    }
+
+
+def update_context(username, patch):
+    """Apply patch(ctx) to this machine's cached context pack, if there is one."""
+    ctx = read_cache(f'{username}.context')
+    if ctx is not None:
+        patch(ctx)
+        write_cache(f'{username}.context', ctx)
+
+
+def set_context_concept(username, row_num, topic, domain, confidence, times, next_review):
+    def patch(ctx):
+        old = ctx['concepts'].get(str(row_num))
+        if old is None and (topic is None or domain is None):
+            ctx['built_at'] = ''    # a row this pack has never seen: rebuild it next time
+            return
+        ctx['concepts'][str(row_num)] = [
+            topic if topic is not None else old[0], domain if domain is not None else old[1],
+            CONFIDENCE_CODES.get(confidence, 0), int(times), date.fromisoformat(next_review).toordinal()]
+    update_context(username, patch)
+
+
+def render_context(username, ctx, budget, today=None):
+    """Markdown summary of `ctx` in at most `budget` tokens (approximated as characters / 4)."""
+    today = (today or date.today()).toordinal()
+    limit = budget * CHARS_PER_TOKEN
+    concepts = list(ctx['concepts'].items())
+    out, used = [], 0
+
+    def emit(line, cap=limit):
+        nonlocal used
+        if used + len(line) + 1 > cap:
+            return False
+        out.append(line)
+        used += len(line) + 1
+        return True
+
+    due = sum(1 for _, c in concepts if 0 < c[4] <= today)
+    emit(f"# Knowledge base: {username}")
+    emit(f"{len(concepts)} concepts | {due} due today")
+
+    # Weak: still Low after being reviewed, or overdue by 3+ days. Weak
+    # concepts and recent sessions share at most half the budget.
+    half = limit // 2
+    weak_cap = used + limit // 4
+    weak = sorted(((row, c) for row, c in concepts
+                   if (c[2] <= CONFIDENCE_CODES['Low'] and c[3] > 0) or 0 < c[4] <= today - 3),
+                  key=lambda rc: (rc[1][2], rc[1][4]))
+    if weak and emit("\n## Weak concepts", weak_cap):
+        shown = 0
+        for row, (topic, _, conf, times, nr) in weak[:WEAK_LIMIT]:
+            overdue = f", {today - nr}d overdue" if 0 < nr < today else ''
+            if not emit(f"- row {row}: {topic} [{CONFIDENCE_LEVELS[conf] or '?'}, {times} reviews{overdue}]", weak_cap):
+                break
+            shown += 1
+        if len(weak) > shown:
+            emit(f"- (+{len(weak) - shown} more)", half)
+
+    recent = [f"- {day}: {topics}" + (f" — {insights}" if insights else '')
+              for day, topics, insights in reversed(ctx.get('recent') or [])]
+    if recent and used + len(recent[0][:240]) + 22 <= half:
+        emit("\n## Recent sessions", half)
+        for line in recent:
+            if not emit(line[:240], half):
+                break
+
+    # Topics grouped by domain, newest first, sharing what budget is left
+    domains = {}
+    for row, c in concepts:
+        domains.setdefault(c[1] or '(no domain)', []).append((int(row), c[0]))
+    if domains and emit("\n## Topics by domain"):
+        ordered = sorted(domains.items(), key=lambda kv: -len(kv[1]))
+        for n, (domain, items) in enumerate(ordered):
+            share = (limit - used) // (len(ordered) - n)
+            if share < 40:
+                emit(f"- (+{len(ordered) - n} more domains)")
+                break
+            items.sort(reverse=True)
+            line = f"- {domain} ({len(items)}): "
+            shown = 0
+            for _, topic in items:
+                more = f" (+{len(items) - shown - 1} more)" if shown + 1 < len(items) else ''
+                if len(line) + len(topic) + 2 + len(more) > share and shown:
+                    break
+                line += ('; ' if shown else '') + topic
+                shown += 1
+            if shown < len(items):
+                line += f" (+{len(items) - shown} more)"
+            emit(line[:share])
+    return '\n'.join(out)
+
+
+def appended_row(resp):
+    """Sheet row number written by append_row(), from the API response."""
+    try:
+        return int(re.search(r'![A-Z]+(\d+)', resp['updates']['updatedRange']).group(1))
+    except (TypeError, KeyError, AttributeError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Prefetch
+# ---------------------------------------------------------------------------
+
+# `due` and `session-start` start `aruni.py prefetch` in the background. It
+# reads the tab once and caches today's due cards plus the weakest recent
+# ones (likely follow-ups), explanations resolved, in .aruni/cache/<user>.prefetch.
+# `show` answers from there without a network call and `update` skips its
+# row read. Reviews done since are kept in <user>.reviewed and laid over the
+# prefetched rows, so a prefetch that finishes late never shows stale history.
+PREFETCH_TTL     = timedelta(hours=3)
+PREFETCH_RESTART = timedelta(minutes=5)   # don't start another prefetch within this window
+PREFETCH_EXTRA   = 10
+
+
+def prefetch_enabled():
+    value = os.environ.get('ARUNI_PREFETCH') or load_config().get('ARUNI_PREFETCH', 'on')
+    return value.lower() not in ('off', '0', 'false', 'no')
+
+
+def start_prefetch(username):
+    """Run `aruni.py prefetch` detached; never blocks or fails the calling command."""
+    if not prefetch_enabled():
+        return
+    import subprocess
+    # Kept apart from the prefetch itself, so this never overwrites rows a
+    # still-running child is about to write
+    started = read_cache(f'{username}.prefetch_started', '')
+    now = datetime.now()
+    try:
+        if now - datetime.fromisoformat(started) < PREFETCH_RESTART:
+            return
+    except (TypeError, ValueError):
+        pass
+    write_cache(f'{username}.prefetch_started', now.isoformat(timespec='seconds'))
+    kwargs = {'stdin': subprocess.DEVNULL, 'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL}
+    if os.name == 'nt':
+        kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    try:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), 'prefetch', username], **kwargs)
+    except OSError:
+        pass
+
+
+def prefetched_row(username, row_num):
+    """Full row (explanation resolved) from a fresh prefetch, with today's reviews applied; else None."""
+    pf = read_cache(f'{username}.prefetch')
+    try:
+        built = datetime.fromisoformat(pf['built_at'])
+    except (TypeError, KeyError, ValueError):
+        return None
+    if built.date() != date.today() or datetime.now() - built > PREFETCH_TTL:
+        return None
+    row = pf['rows'].get(str(row_num))
+    if row is None:
+        return None
+    reviewed = read_cache(f'{username}.reviewed', {})
+    if reviewed.get('date') == date.today().isoformat() and str(row_num) in reviewed['rows']:
+        row = list(row)
+        row[4], row[6], row[7], row[8] = reviewed['rows'][str(row_num)]
+    return row
+
+
+def note_review(username, row_num, confidence, last_reviewed, next_review, times):
+    today = date.today().isoformat()
+    reviewed = read_cache(f'{username}.reviewed', {})
+    if reviewed.get('date') != today:
+        reviewed = {'date': today, 'rows': {}}
+    reviewed['rows'][str(row_num)] = [confidence, last_reviewed, next_review, str(times)]
+    write_cache(f'{username}.reviewed', reviewed)
+
+
+# ---------------------------------------------------------------------------
+# Review queue
+# ---------------------------------------------------------------------------
+
+# `next` serves due cards a page at a time, most urgent first. The first call
+# scans the tab once and keeps the rest as a heap in .aruni/cache/<user>.queue;
+# each follow-up pops the next page off that heap without touching the sheet.
+QUEUE_LIMIT     = 10
+QUEUE_MAX_LIMIT = 50
+
+
+def review_priority(table, i, today):
+    """Higher is more urgent: days overdue (log scale), weak confidence, and a miss last time."""
+    overdue = max(0, today - table.next_review[i])
+    score = math.log1p(overdue) + (2, 2, 1, 0)[table.confidence[i]]
+    if table.lapsed(i):
+        # The more reviews a card has had and is still being missed, the more it needs work
+        score += 1.5 + 0.25 * min(table.times_reviewed[i], 8)
+    return score
+
+
+def build_queue(table, today=None):
+    """Heap of due cards, each [-priority, row, topic, confidence, times, overdue_days, lapsed, question]."""
+    t = (today or date.today()).toordinal()
+    heap = [[-round(review_priority(table, i, t), 4), table.row_number(i), table.topic[i],
+             table.confidence_of(i), table.times_reviewed[i], t - table.next_review[i],
+             table.lapsed(i), table.questions[i]] for i in table.due(today)]
+    heapq.heapify(heap)
+    return heap
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+# Counters and latency histograms per command and per Google API operation.
+# On exit each script folds its run into cumulative totals in
+# .aruni/metrics/<script>.json and rewrites <script>.prom beside it for
+# node_exporter's textfile collector. summary.json keeps per-day totals for
+# the last METRICS_DAYS days. ARUNI_METRICS=off turns it all off.
+METRICS_DIR     = os.path.join(ARUNI_DIR, '.aruni', 'metrics')   # unless ARUNI_METRICS_DIR is set
+METRICS_DAYS    = 30
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRIC_HELP = {
+    'aruni_commands_total':      ('counter',   'Commands run, by result'),
+    'aruni_command_seconds':     ('histogram', 'Command wall time in seconds'),
+    'aruni_api_requests_total':  ('counter',   'Google API requests, by operation and HTTP status'),
+    'aruni_api_request_seconds': ('histogram', 'Google API request latency in seconds'),
+    'aruni_emails_total':        ('counter',   'Review emails, by result'),
+    'aruni_email_send_seconds':  ('histogram', 'SMTP send time per email in seconds'),
+}
+
+_counters, _histograms = {}, {}
+_metrics_lock = threading.Lock()
+
+
+def metrics_enabled():
+    value = os.environ.get('ARUNI_METRICS') or load_config().get('ARUNI_METRICS', 'on')
+    return value.lower() not in ('off', '0', 'false', 'no')
+
+
+def metrics_dir():
+    """Read when flushing, not at import: the scripts load .env after importing this module."""
+    return os.environ.get('ARUNI_METRICS_DIR') or load_config().get('ARUNI_METRICS_DIR') or METRICS_DIR
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    quote = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"')
+    return name + '{' + ','.join(f'{k}="{quote(v)}"' for k, v in sorted(labels.items())) + '}'
+
+
+def count(name, value=1, **labels):
+    key = _series(name, labels)
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    key = _series(name, labels)
+    with _metrics_lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0] * len(LATENCY_BUCKETS)}
+        h['count'] += 1
+        h['sum'] += seconds
+        h['max'] = max(h['max'], seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                h['buckets'][i] += 1
+
+
+@contextmanager
+def timed(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def api_op(method, url):
+    """Short name for a Google API call, e.g. values.get, values.append, spreadsheets.batchUpdate."""
+    from urllib.parse import urlsplit
+    parts = urlsplit(url)
+    if parts.netloc.startswith('oauth2.'):
+        return 'oauth.token'
+    if '/drive/' in parts.path:
+        return 'drive.permissions' if '/permissions' in parts.path else 'drive.' + method.lower()
+    verb = re.search(r':(append|clear|batch[A-Za-z]+|copyTo)$', parts.path)
+    if '/values' in parts.path:
+        return 'values.' + (verb.group(1) if verb else {'GET': 'get', 'PUT': 'update'}.get(method, method.lower()))
+    if verb:
+        return 'spreadsheets.' + verb.group(1)
+    return 'spreadsheets.' + ('get' if method == 'GET' else 'create' if method == 'POST' else method.lower())
+
+
+def _record_response(resp, *args, **kwargs):
+    op = api_op(resp.request.method, resp.url)
+    count('aruni_api_requests_total', op=op, status=resp.status_code)
+    observe('aruni_api_request_seconds', resp.elapsed.total_seconds(), op=op)
+
+
+def instrument(client):
+    """Count and time every request made through a gspread client or requests session."""
+    session = (getattr(getattr(client, 'http_client', None), 'session', None)
+               or getattr(client, 'session', None) or client)
+    hooks = session.hooks.setdefault('response', [])
+    if _record_response not in hooks:
+        hooks.append(_record_response)
+    return client
+
+
+@contextmanager
+def track_command(script, command):
+    """Count and time one command, then flush the script's metrics — also on errors and sys.exit()."""
+    start, result = time.perf_counter(), 'error'
+    try:
+        yield
+        result = 'ok'
+    except SystemExit as e:
+        result = 'error' if e.code else 'ok'
+        raise
+    finally:
+        count('aruni_commands_total', command=command, result=result)
+        observe('aruni_command_seconds', time.perf_counter() - start, command=command)
+        flush_metrics(script)
+
+
+def _merge_metrics(dst, counters, histograms, buckets=True):
+    totals = dst.setdefault('counters', {})
+    for k, v in counters.items():
+        totals[k] = totals.get(k, 0) + v
+    hists = dst.setdefault('histograms', {})
+    for k, v in histograms.items():
+        h = hists.setdefault(k, {'count': 0, 'sum': 0.0, 'max': 0.0})
+        h['count'] += v['count']
+        h['sum'] = round(h['sum'] + v['sum'], 6)
+        h['max'] = round(max(h['max'], v['max']), 6)
+        if buckets:
+            h['buckets'] = [a + b for a, b in zip(h.get('buckets') or [0] * len(v['buckets']), v['buckets'])]
+
+
+def _with_label(series, key, value):
+    extra = f'{key}="{value}"'
+    if series.endswith('}'):
+        return series[:-1] + ',' + extra + '}'
+    return series + '{' + extra + '}'
+
+
+def render_prometheus(totals, script):
+    """Prometheus text exposition of a script's cumulative totals, labelled with script=<script>."""
+    lines, seen = [], set()
+
+    def family(series):
+        name = series.split('{', 1)[0]
+        if name not in seen:
+            seen.add(name)
+            kind, text = METRIC_HELP.get(name, ('untyped', name))
+            lines.extend([f'# HELP {name} {text}', f'# TYPE {name} {kind}'])
+        return name, series[len(name):]
+
+    for series, value in sorted(totals.get('counters', {}).items()):
+        name, labels = family(series)
+        lines.append(f"{_with_label(name + labels, 'script', script)} {value}")
+    for series, h in sorted(totals.get('histograms', {}).items()):
+        name, labels = family(series)
+        base = _with_label(name + '_bucket' + labels, 'script', script)
+        for bound, n in zip(LATENCY_BUCKETS, h['buckets']):
+            lines.append(f"{_with_label(base, 'le', bound)} {n}")
+        lines.append(f"{_with_label(base, 'le', '+Inf')} {h['count']}")
+        lines.append(f"{_with_label(name + '_sum' + labels, 'script', script)} {h['sum']}")
+        lines.append(f"{_with_label(name + '_count' + labels, 'script', script)} {h['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_atomic(path, text):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def flush_metrics(script):
+    """Fold this run's metrics into the script's totals, its .prom textfile and the daily summary."""
+    with _metrics_lock:
+        counters, histograms = dict(_counters), dict(_histograms)
+        _counters.clear()
+        _histograms.clear()
+    if not (counters or histograms) or not metrics_enabled():
+        return
+    try:
+        directory = metrics_dir()
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, '.lock'), 'a') as lock:
+            try:
+                import fcntl
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            except ImportError:
+                pass
+            state = os.path.join(directory, script + '.json')
+            totals = _read_json(state, {})
+            _merge_metrics(totals, counters, histograms)
+            _write_atomic(state, json.dumps(totals, separators=(',', ':')))
+            _write_atomic(os.path.join(directory, script + '.prom'), render_prometheus(totals, script))
+
+            path = os.path.join(directory, 'summary.json')
+            summary = _read_json(path, {})
+            days = summary.setdefault('days', {})
+            _merge_metrics(days.setdefault(date.today().isoformat(), {}).setdefault(script, {}),
+                           counters, histograms, buckets=False)
+            for old in sorted(days)[:-METRICS_DAYS]:
+                del days[old]
+            summary['updated_at'] = datetime.now().isoformat(timespec='seconds')
+            _write_atomic(path, json.dumps(summary, indent=1, sort_keys=True))
+    except OSError:
+        pass    # metrics must never break a command
+
+
+# ---------------------------------------------------------------------------
+# Commands
+# ---------------------------------------------------------------------------
+
 def cmd_due(username):
     """Show concepts due for review today."""
     sh, ws = connect(username)
-    rows = ws.get_all_records()
-    today = datetime.now().strftime('%Y-%m-%d')
-    due = [r for r in rows if r.get('next_review') and str(r['next_review']) <= today]
-    print(f"TODAY: {today}")
-    print(f"TOTAL: {len(rows)} concepts | DUE: {len(due)}")
+    today = date.today()
+
+    # First call of the day: last night's digest is still accurate, so skip
+    # reading the whole tab. Any later call (or one after add/update) reads live.
+    digest = None
+    state = read_cache(f'{username}.state', {})
+    if state.get('touched') != today.isoformat():
+        digest = read_digest(sh, username, today)
+    if digest is not None:
+        total, due = digest['total'], digest['due']
+    else:
+        table = resolve_questions(sh, ConceptTable.from_worksheet(ws))
+        total = len(table)
+        due = [[table.row_number(i), table.confidence_of(i), table.times_reviewed[i],
+                table.topic[i], table.questions[i]] for i in table.due(today)]
+    mark_touched(username)
+
+    print(f"TODAY: {today.isoformat()}")
+    print(f"TOTAL: {total} concepts | DUE: {len(due)}")
     if due:
         print()
-        for i, r in enumerate(due):
-            row_num = rows.index(r) + 2
-            print(f"  [{i+1}] row={row_num} [{r.get('confidence','?')}] {r['topic']}")
-            print(f"       Q: {r.get('questions','(no question)')}")
+        for n, (row_num, confidence, _, topic, question) in enumerate(due):
+            print(f"  [{n+1}] row={row_num} [{confidence or '?'}] {topic}")
+            print(f"       Q: {question or '(no question)'}")
     else:
         print("Nothing due today — great work!")
+    start_prefetch(username)
+
+
+REVIEW_INTERVALS = {1: 1, 2: 3, 3: 7, 4: 14}   # days until the next review after the nth; 30 after that
+
+
+def schedule_review(times, confidence, correct):
+    """(confidence, days until next review) after a card's `times`-th review."""
+    if not correct:
+        return 'Low', 1
+    days = REVIEW_INTERVALS.get(times, 30)
+    if times >= 5:   return 'High', days
+    elif times >= 3: return 'Medium', days
+    else:            return confidence or 'Low', days
 
 
 def cmd_update(username, row_num, result):
     """Update a concept after review. result = 'correct' or 'wrong'."""
     sh, ws = connect(username)
     row_num = int(row_num)
-    row = ws.row_values(row_num)
+    row = prefetched_row(username, row_num) or ws.row_values(row_num)
     # cols: topic(1) domain(2) explanation(3) questions(4) confidence(5)
     #       created_at(6) last_reviewed(7) next_review(8) times_reviewed(9)
     times = int(row[8]) + 1 if len(row) > 8 and row[8] else 1
     now = datetime.now()
     last_reviewed = now.strftime('%Y-%m-%d %H:%M')
-    correct = result.lower().startswith('c')
-
-    if correct:
-        intervals = {1: 1, 2: 3, 3: 7, 4: 14}
-        days = intervals.get(times, 30)
-        if times >= 5:   confidence = 'High'
-        elif times >= 3: confidence = 'Medium'
-        else:            confidence = row[4] if len(row) > 4 and row[4] else 'Low'
-    else:
-        days = 1
-        confidence = 'Low'
-
+    confidence, days = schedule_review(times, row[4] if len(row) > 4 else '', result.lower().startswith('c'))
     next_date = (now + timedelta(days=days)).strftime('%Y-%m-%d')
     ws.update_cell(row_num, 5, confidence)
     ws.update_cell(row_num, 7, last_reviewed)
     ws.update_cell(row_num, 8, next_date)
     ws.update_cell(row_num, 9, times)
+    mark_touched(username)
+    invalidate_digest(sh, username)
+    note_review(username, row_num, confidence, last_reviewed, next_date, times)
+    set_context_concept(username, row_num, None, None, confidence, times, next_date)
     print(f"Updated row {row_num}: confidence={confidence}, next_review={next_date} (+{days}d), reviews={times}")
 
 
@@ -97,9 +1381,21 @@ def cmd_add(username, topic, domain, explanation, question):
     now      = datetime.now()
     created  = now.strftime('%Y-%m-%d %H:%M')
     tomorrow = (now + timedelta(days=1)).strftime('%Y-%m-%d')
+    shared = catalog_enabled()
+    if shared:
+        explanation, question = put_catalog(sh, [(domain, topic, explanation, question)])[0], ''
+    elif blobs_enabled():
+        explanation = put_blob(sh, explanation)
     # cols: topic domain explanation questions confidence created_at last_reviewed next_review times_reviewed
-    ws.append_row([topic, domain, explanation, question, 'Low', created, '', tomorrow, 0])
-    print(f"Added: '{topic}' — next review tomorrow ({tomorrow})")
+    resp = ws.append_row([topic, domain, explanation, question, 'Low', created, '', tomorrow, 0])
+    mark_touched(username)
+    invalidate_digest(sh, username)
+    row_num = appended_row(resp)
+    if row_num:
+        set_context_concept(username, row_num, topic, domain, 'Low', 0, tomorrow)
+    else:
+        update_context(username, lambda ctx: ctx.update(built_at=''))   # force a rebuild
+    print(f"Added: '{topic}' — next review tomorrow ({tomorrow})" + (f" [{explanation}]" if shared else ''))
 
 
 def cmd_session_start(username, domain):
@@ -110,10 +1406,12 @@ def cmd_session_start(username, domain):
     date     = now.strftime('%Y-%m-%d')
     start_time = now.strftime('%H:%M')
     # columns: user date start_time end_time duration_minutes domain concepts_covered key_insights open_questions
-    sessions.append_row([username, date, start_time, '', '', domain, '', '', ''])
-    all_rows = sessions.get_all_values()
-    session_row = len(all_rows)  # 1-based row number of the row just added
+    resp = sessions.append_row([username, date, start_time, '', '', domain, '', '', ''])
+    session_row = appended_row(resp)
+    if session_row is None:
+        session_row = len(sessions.get_all_values())  # 1-based row number of the row just added
     print(f"SESSION_START: row={session_row} time={start_time} date={date}")
+    start_prefetch(username)
 
 
 def cmd_session_end(username, session_row, topics_covered, key_insights):
@@ -141,22 +1439,149 @@ def cmd_session_end(username, session_row, topics_covered, key_insights):
     sessions.update_cell(session_row, 5, duration_minutes)
     sessions.update_cell(session_row, 7, topics_covered)
     sessions.update_cell(session_row, 8, key_insights)
+
+    # Only the first session-end for a row counts towards the rollup
+    if not (len(row) > 3 and row[3]):
+        try:
+            day = date.fromisoformat(row[1]) if len(row) > 1 and row[1] else now.date()
+        except ValueError:
+            day = now.date()
+        r = update_rollup(sh, username, day, duration_minutes or 0, topics_covered, key_insights)
+        update_context(username, lambda ctx: ctx.update(recent=r['recent']))
     print(f"Session complete: {duration_minutes} min | topics: {topics_covered}")
 
 
 def cmd_status(username):
     """Show learning progress summary."""
     sh, ws = connect(username)
-    rows = ws.get_all_records()
-    today = datetime.now().strftime('%Y-%m-%d')
-    due  = [r for r in rows if r.get('next_review') and str(r['next_review']) <= today]
-    high = [r for r in rows if r.get('confidence') == 'High']
-    med  = [r for r in rows if r.get('confidence') == 'Medium']
-    low  = [r for r in rows if r.get('confidence') == 'Low']
+    total, due, low, med, high = ConceptTable.from_worksheet(ws).summary()
     print(f"Learner  : {username}")
-    print(f"Total    : {len(rows)} concepts")
-    print(f"Due today: {len(due)}")
-    print(f"High     : {len(high)} | Medium: {len(med)} | Low: {len(low)}")
+    print(f"Total    : {total} concepts")
+    print(f"Due today: {due}")
+    print(f"High     : {high} | Medium: {med} | Low: {low}")
+
+
+def cmd_stats(username):
+    """Show session analytics from the learner's rollup (never scans the sessions tab)."""
+    sh, ws = connect(username)
+    r = read_rollup(sh, username)
+    this_week = r['weeks'].get(week_key(date.today()), [0, 0, 0])
+    per_session = r['concepts'] / r['sessions'] if r['sessions'] else 0
+    print(f"Learner          : {username}")
+    print(f"Sessions         : {r['sessions']} ({r['minutes']} min total)")
+    print(f"Concepts/session : {per_session:.1f}")
+    print(f"Streak           : {current_streak(r)} day(s) | longest: {r['longest_streak']}")
+    print(f"This week        : {this_week[0]} session(s), {this_week[1]} min, {this_week[2]} concept(s)")
+    if r['weeks']:
+        print()
+        print("Week       Sessions  Minutes  Concepts")
+        for key in sorted(r['weeks'], reverse=True):
+            n, minutes, concepts = r['weeks'][key]
+            print(f"{key:<10} {n:>8} {minutes:>8} {concepts:>9}")
+
+
+def cmd_show(username, row_num):
+    """Show one concept in full, including its explanation (fetched lazily from the blobs or catalog tab)."""
+    row_num = int(row_num)
+    row = prefetched_row(username, row_num)
+    if row is None:
+        sh, ws = connect(username)
+        row = ws.row_values(row_num)
+        if row:
+            row = expand_row(sh, row)
+    if not row:
+        print(f"Row {row_num} is empty")
+        return
+    print(f"row={row_num} [{_cell(row, 4) or '?'}] {_cell(row, 0)} ({_cell(row, 1)})")
+    print(f"Q: {_cell(row, 3) or '(no question)'}")
+    print(f"Reviews: {_cell(row, 8) or 0} | last: {_cell(row, 6) or '-'} | next: {_cell(row, 7) or '-'}")
+    print()
+    print(_cell(row, 2))
+
+
+def cmd_prefetch(username):
+    """Cache today's due cards and likely follow-ups, explanations resolved, for show/update."""
+    started = datetime.now()
+    sh, ws = connect(username)
+    values = ws.get_all_values()
+    table = ConceptTable.from_values(values)
+    due = table.due()
+    picked = set(due)
+    weak = sorted((i for i in range(len(table))
+                   if i not in picked and table.confidence[i] <= CONFIDENCE_CODES['Low']),
+                  key=lambda i: -table.last_reviewed[i])[:PREFETCH_EXTRA]
+
+    rows = {}
+    for i in due + weak:
+        n = table.row_number(i)
+        if n <= len(values):
+            rows[n] = (values[n - 1] + [''] * 9)[:9]
+    entries = catalog_entries(sh, [r[2] for r in rows.values() if r[2].startswith(CATALOG_PREFIX)])
+    for r in rows.values():
+        if r[2] in entries and not r[3]:
+            r[3] = entries[r[2]][1]
+    for n, text in zip(rows, resolve_texts(sh, [r[2] for r in rows.values()])):
+        rows[n][2] = text
+
+    write_cache(f'{username}.prefetch', {'built_at': started.isoformat(timespec='seconds'),
+                                          'rows': {str(n): r for n, r in rows.items()}})
+    print(f"Prefetched {len(due)} due and {len(weak)} follow-up card(s) for {username}")
+
+
+def cmd_context(username, budget=CONTEXT_BUDGET, refresh=''):
+    """Print a size-bounded knowledge-base summary for the LLM, from the local cache when fresh."""
+    ctx = read_cache(f'{username}.context')
+    stale = (not ctx or refresh or not ctx.get('built_at') or
+             datetime.now() - datetime.strptime(ctx['built_at'], '%Y-%m-%d %H:%M') > CONTEXT_TTL)
+    if stale:
+        sh, ws = connect(username)
+        ctx = build_context(ConceptTable.from_worksheet(ws), read_rollup(sh, username))
+        write_cache(f'{username}.context', ctx)
+    print(render_context(username, ctx, int(budget)))
+
+
+def cmd_forecast(username, days='14'):
+    """Show how many concepts come due on each of the next N days."""
+    sh, ws = connect(username)
+    days = int(days)
+    today = date.today()
+    counts = ConceptTable.from_worksheet(ws).forecast(days, today)
+    print(f"Forecast for {username} (next {days} days):")
+    for k, n in enumerate(counts):
+        day = today + timedelta(days=k)
+        print(f"  {day.isoformat()} {day.strftime('%a')}  {n:>4}  {'#' * min(n, 50)}")
+
+
+def cmd_next(username, limit=QUEUE_LIMIT, cursor=''):
+    """Next page of due cards, most urgent first, as JSON. Pass the returned cursor to continue."""
+    limit = max(1, min(int(limit), QUEUE_MAX_LIMIT))
+    today = date.today()
+    queue = read_cache(f'{username}.queue') if cursor else None
+    restarted = False
+    if not queue or queue.get('date') != today.isoformat() or cursor != f"{queue['id']}.{queue['served']}":
+        # No cursor, or one from an older queue (another day, or a page was re-requested): rescan
+        restarted = bool(cursor)
+        sh, ws = connect(username)
+        queue = {'id': os.urandom(4).hex(), 'date': today.isoformat(), 'served': 0,
+                 'heap': build_queue(resolve_questions(sh, ConceptTable.from_worksheet(ws)), today)}
+        mark_touched(username)
+
+    heap = queue['heap']
+    page = [heapq.heappop(heap) for _ in range(min(limit, len(heap)))]
+    queue['served'] += len(page)
+    write_cache(f'{username}.queue', queue)
+
+    out = {
+        'today': today.isoformat(),
+        'cards': [{'row': row, 'topic': topic, 'confidence': confidence or 'Low', 'times_reviewed': times,
+                   'overdue_days': overdue, 'missed_last_time': lapsed, 'question': question,
+                   'priority': -neg} for neg, row, topic, confidence, times, overdue, lapsed, question in page],
+        'remaining': len(heap),
+        'cursor': f"{queue['id']}.{queue['served']}" if heap else None,
+    }
+    if restarted:
+        out['restarted'] = True
+    print(json.dumps(out, ensure_ascii=False))
 
 
 COMMANDS = {
@@ -166,24 +1591,43 @@ COMMANDS = {
     'session-start': (cmd_session_start, ['username', 'domain']),
     'session-end':   (cmd_session_end,   ['username', 'session_row', 'topics_covered', 'key_insights']),
     'status':        (cmd_status,        ['username']),
+    'forecast':      (cmd_forecast,      ['username', '[days]']),
+    'stats':         (cmd_stats,         ['username']),
+    'context':       (cmd_context,       ['username', '[--budget N]', '[--refresh 1]']),
+    'show':          (cmd_show,          ['username', 'row']),
+    'next':          (cmd_next,          ['username', '[--limit N]', '[--cursor C]']),
+    'prefetch':      (cmd_prefetch,      ['username']),
 }
 
 if __name__ == '__main__':
     if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
         print("Usage:")
         for cmd, (fn, args) in COMMANDS.items():
-            print(f"  python3 aruni.py {cmd} {' '.join('<'+a+'>' for a in args)}")
+            print(f"  python3 aruni.py {cmd} {' '.join(a if a.startswith('[') else '<'+a+'>' for a in args)}")
         sys.exit(1)
 
     cmd = sys.argv[1]
     fn, args = COMMANDS[cmd]
-    if len(sys.argv) < 2 + len(args):
-        print(f"Usage: python3 aruni.py {cmd} {' '.join('<'+a+'>' for a in args)}")
+    # `--name value` options declared in COMMANDS become keyword arguments;
+    # anything else (say, a question that starts with `--`) stays positional
+    declared = {a[1:-1].split()[0] for a in args if a.startswith('[--')}
+    argv, options = [], {}
+    rest = iter(sys.argv[2:])
+    for a in rest:
+        if a in declared:
+            options[a[2:].replace('-', '_')] = next(rest, '')
+        else:
+            argv.append(a)
+    required   = [a for a in args if not a.startswith('[')]
+    positional = [a for a in args if not a.startswith('[--')]
+    if len(argv) < len(required):
+        print(f"Usage: python3 aruni.py {cmd} {' '.join(a if a.startswith('[') else '<'+a+'>' for a in args)}")
         sys.exit(1)
 
-    try:
-        fn(*sys.argv[2:2+len(args)])
-    except Exception as e:
-        print(f"ERROR: {e}")
-        import traceback; traceback.print_exc()
-        sys.exit(1)
+    with track_command('aruni', cmd):
+        try:
+            fn(*argv[:len(positional)], **options)
+        except Exception as e:
+            print(f"ERROR: {e}")
+            import traceback; traceback.print_exc()
+            sys.exit(1)
@@ -7,16 +7,34 @@ Named after Uddalaka Aruni, the Vedic sage who taught through questions.
 Commands:
     python3 setup.py init              Initialize data store and folder structure
     python3 setup.py add-user          Add a new learner (interactive)
-    python3 setup.py regenerate USER   Re-generate prompt files for a user
+    python3 setup.py add-users FILE    Add every learner in a CSV (resumable)
+    python3 setup.py regenerate USER.. Re-generate prompt files for one or more users
+    python3 setup.py regenerate-all    Re-generate prompt files for every user (changed files only)
     python3 setup.py status            Show all users and their learning stats
     python3 setup.py migrate USER FILE Import concepts from a Notion export JSON
+    python3 setup.py add-shard         Add another spreadsheet for new learners
+    python3 setup.py rebuild-rollups   Recompute session rollups from the sessions tabs
+    python3 setup.py export [--full]   Back up every tab (incremental unless --full)
+    python3 setup.py restore [STAMP]   Write a backup back to the spreadsheets
 """
 
 import os
 import sys
+import re
+import gzip
 import json
+import time
+import asyncio
+import hashlib
+from urllib.parse import quote
 from datetime import datetime, timedelta
 
+from aruni import (AsyncSheets, BATCH_GET_RANGES, ConceptTable, ROLLUP_HEADERS, SHARDS_HEADERS, a1,
+                   blobs_enabled, catalog_enabled, count_topics, current_streak, empty_rollup, fold_session,
+                   group_by_shard, instrument, list_shards, load_credentials, open_shard,
+                   parse_rollup_row, put_blobs, put_catalog, rollup_row, shard_ids, shard_of, to_records,
+                   track_command, week_key)
+
 ARUNI_DIR = os.path.dirname(os.path.abspath(__file__))
 ENV_PATH = os.path.join(ARUNI_DIR, '.env')
 TEMPLATE_PATH = os.path.join(ARUNI_DIR, '.aruni', 'prompt_template.md')
@@ -27,10 +45,15 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive'
 ]
 
-CONFIG_HEADERS = ['user', 'name', 'email', 'domain', 'learning_goal', 'joined_at', 'custom_instructions']
+CONFIG_HEADERS = ['user', 'name', 'email', 'domain', 'learning_goal', 'joined_at', 'custom_instructions', 'shard']
 KB_HEADERS = ['topic', 'domain', 'explanation', 'questions', 'confidence', 'created_at', 'last_reviewed', 'next_review', 'times_reviewed']
 SESSIONS_HEADERS = ['user', 'date', 'start_time', 'end_time', 'duration_minutes', 'domain', 'concepts_covered', 'key_insights', 'open_questions']
 
+# Learner tabs per spreadsheet before add-user opens a new shard. Each tab is
+# created with 1000 rows, so this leaves plenty of headroom under the
+# 10M-cell limit as decks grow.
+SHARD_CAPACITY = 100
+
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -82,11 +105,8 @@ def check_dependencies():
         return False
 
 
-def get_gspread_client():
-    """Authenticate and return gspread client"""
-    from google.oauth2.service_account import Credentials
-    import gspread
-
+def get_creds_path():
+    """Resolve the service account key path, exiting with a hint if it is missing"""
     creds_path = os.environ.get('ARUNI_KEY_PATH', os.path.join(ARUNI_DIR, '.aruni.key'))
     # Resolve relative paths from ARUNI_DIR
     if not os.path.isabs(creds_path):
@@ -98,19 +118,67 @@ def get_gspread_client():
         print("Run setup_new_machine.sh (Mac/Linux) or setup_new_machine.bat (Windows)")
         print("and enter the Aruni password when prompted.")
         sys.exit(1)
+    return creds_path
+
 
+def get_gspread_client():
+    """Authenticate and return gspread client"""
+    from google.oauth2.service_account import Credentials
+    import gspread
+
+    creds_path = get_creds_path()
     creds = Credentials.from_service_account_file(creds_path, scopes=SCOPES)
-    return gspread.authorize(creds), creds_path
+    return instrument(gspread.authorize(creds)), creds_path
 
 
-def get_sheet():
-    """Get the Aruni data store"""
-    gc, _ = get_gspread_client()
+def get_async_client():
+    """Async Sheets client for the fan-out commands, using the same service account"""
+    return AsyncSheets(load_credentials(get_creds_path(), SCOPES))
+
+
+def get_sheet_id():
     sheet_id = os.environ.get('ARUNI_DB')
     if not sheet_id:
         print("ERROR: No ARUNI_DB in .env. Run 'python3 setup.py init' first.")
         sys.exit(1)
-    return gc.open_by_key(sheet_id)
+    return sheet_id
+
+
+async def read_config_async(client, sheet_id):
+    """Config rows via the async client"""
+    return to_records(await client.values(sheet_id, 'config') or [])
+
+
+async def read_summaries_async(client, sheet_id, users):
+    """{username: ConceptTable summary or None}, one batched read per shard, all shards concurrently"""
+    groups = group_by_shard(users)
+    results = await asyncio.gather(*(
+        client.batch_values(shard_id or sheet_id, [u.get('user', '') for u in shard_users])
+        for shard_id, shard_users in groups.items()))
+    summaries = {}
+    for tabs in results:
+        for username, values in tabs.items():
+            summaries[username] = ConceptTable.from_values(values).summary() if values is not None else None
+    return summaries
+
+
+async def read_rollups_async(client, sheet_id, users):
+    """{username: rollup dict} from each shard's rollups tab, all shards concurrently"""
+    groups = group_by_shard(users)
+    results = await asyncio.gather(*(client.values(shard_id or sheet_id, 'rollups') for shard_id in groups))
+    rollups = {}
+    for values in results:
+        for row in (values or [])[1:]:
+            if row and row[0]:
+                rollups[row[0]] = parse_rollup_row(row)
+    return rollups
+
+
+def get_sheet(gc=None):
+    """Get the Aruni data store"""
+    if gc is None:
+        gc, _ = get_gspread_client()
+    return gc.open_by_key(get_sheet_id())
 
 
 def read_config_tab(sh):
@@ -122,6 +190,49 @@ def read_config_tab(sh):
         return []
 
 
+def ensure_config_headers(config_ws):
+    """Add header cells for config columns introduced after the tab was created"""
+    header = config_ws.row_values(1)
+    if header[:len(CONFIG_HEADERS)] != CONFIG_HEADERS:
+        config_ws.update([CONFIG_HEADERS], 'A1')
+
+
+def create_shard(gc, sh):
+    """Create a new shard spreadsheet with a sessions tab and register it in the shards tab"""
+    import gspread
+
+    try:
+        shards_ws = sh.worksheet('shards')
+    except gspread.exceptions.WorksheetNotFound:
+        shards_ws = sh.add_worksheet('shards', rows=100, cols=len(SHARDS_HEADERS))
+        shards_ws.update([SHARDS_HEADERS], 'A1')
+
+    title = f"Aruni Learning System (shard {len(list_shards(sh))})"
+    shard = gc.create(title)
+    sessions_ws = shard.add_worksheet('sessions', rows=1000, cols=len(SESSIONS_HEADERS))
+    sessions_ws.update([SESSIONS_HEADERS], 'A1')
+    try:
+        shard.del_worksheet(shard.worksheet('Sheet1'))
+    except Exception:
+        pass
+
+    shards_ws.append_row([shard.id, title, datetime.now().strftime('%Y-%m-%d %H:%M')])
+    print(f"  Created shard '{title}': https://docs.google.com/spreadsheets/d/{shard.id}")
+    return shard.id
+
+
+def pick_shard(gc, sh, users):
+    """Least-loaded shard with room for another learner, creating one if all are full"""
+    capacity = int(os.environ.get('ARUNI_SHARD_CAPACITY', SHARD_CAPACITY))
+    load = {shard_id: 0 for shard_id in list_shards(sh)}
+    for u in users:
+        load[shard_of(u)] = load.get(shard_of(u), 0) + 1
+    shard_id, count = min(load.items(), key=lambda kv: kv[1])
+    if count >= capacity:
+        shard_id = create_shard(gc, sh)
+    return shard_id
+
+
 # ---------------------------------------------------------------------------
 # Commands
 # ---------------------------------------------------------------------------
@@ -213,7 +324,8 @@ def cmd_add_user():
 
     import gspread
 
-    sh = get_sheet()
+    gc, _ = get_gspread_client()
+    sh = get_sheet(gc)
 
     print()
     print("--- Add New Learner ---")
@@ -243,24 +355,33 @@ def cmd_add_user():
 
     joined_at = datetime.now().strftime('%Y-%m-%d %H:%M')
 
-    # Add to config tab
+    # Route the learner to a shard, then add to config tab (the routing map)
     config_ws = sh.worksheet('config')
-    config_ws.append_row([username, name, email, domain, goal, joined_at, custom])
-    print(f"  Added {username} to config tab")
+    ensure_config_headers(config_ws)
+    users = config_ws.get_all_records()
+    existing = next((u for u in users if u.get('user') == username), None)
+    if existing:
+        shard_id = shard_of(existing)
+        print(f"  {username} already in config tab")
+    else:
+        shard_id = pick_shard(gc, sh, users)
+        config_ws.append_row([username, name, email, domain, goal, joined_at, custom, shard_id])
+        print(f"  Added {username} to config tab")
+    shard = open_shard(gc, sh, shard_id)
 
     # Create user tab
     try:
-        sh.worksheet(username)
+        shard.worksheet(username)
         print(f"  Tab '{username}' already exists")
     except gspread.exceptions.WorksheetNotFound:
-        user_ws = sh.add_worksheet(username, rows=1000, cols=len(KB_HEADERS))
+        user_ws = shard.add_worksheet(username, rows=1000, cols=len(KB_HEADERS))
         user_ws.update([KB_HEADERS], 'A1')
         print(f"  Created tab '{username}'")
 
     # Share sheet with user
     if email:
         try:
-            sh.share(email, perm_type='user', role='writer')
+            shard.share(email, perm_type='user', role='writer')
             print(f"  Sheet shared with {email}")
         except Exception as e:
             print(f"  NOTE: Could not auto-share with {email}: {e}")
@@ -293,79 +414,340 @@ def cmd_add_user():
     print()
     print(f'  Then just say: "I\'m ready to review" or "Teach me something new"')
     print()
-    sheet_id = os.environ.get('ARUNI_DB')
-    print(f"  Sheet: https://docs.google.com/spreadsheets/d/{sheet_id}")
+    print(f"  Sheet: https://docs.google.com/spreadsheets/d/{shard.id}")
+
+
+# add-users reads a CSV with a header row naming some of these columns ('user'
+# is required). Progress is kept in <csv>.state.json: the shard each new learner
+# was routed to (saved before anything is written, so a rerun routes them the
+# same way) and who has been shared with. Tabs and config rows are found by
+# reading the spreadsheets, so a rerun after an interruption picks up where it
+# stopped.
+ADD_USERS_COLUMNS = ['user', 'name', 'email', 'domain', 'learning_goal', 'custom_instructions']
+RESERVED_TABS = {'config', 'sessions', 'shards', 'digest', 'rollups', 'blobs', 'catalog'}
+USERNAME = re.compile(r'[a-z0-9_.-]+')
+EMAIL = re.compile(r'[^@\s]+@[^@\s]+\.[^@\s]+')
+DRIVE_API = 'https://www.googleapis.com/drive/v3/files'
+SHARE_CONCURRENCY = 4   # Drive permission calls in flight at once
+
+
+def read_users_csv(csv_path):
+    """(learners, errors) from an add-users CSV; nothing is written unless errors is empty"""
+    import csv
+
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        header = [h.strip() for h in reader.fieldnames or []]
+        errors = [f"unknown column '{h}'" for h in header if h not in ADD_USERS_COLUMNS]
+        if 'user' not in header:
+            errors.append("missing 'user' column")
+        if errors:
+            return [], errors
+        rows = [{k.strip(): (v or '').strip() for k, v in r.items() if k} for r in reader]
+
+    learners, seen = [], {}
+    for line, r in enumerate(rows, start=2):
+        username = r.get('user', '').lower().replace(' ', '_')
+        if not any(r.values()):
+            continue
+        if not username:
+            errors.append(f"line {line}: user is empty")
+        elif not USERNAME.fullmatch(username):
+            errors.append(f"line {line}: user '{username}' may only use a-z, 0-9, '_', '.' and '-'")
+        elif username in RESERVED_TABS:
+            errors.append(f"line {line}: '{username}' is a reserved tab name")
+        elif username in seen:
+            errors.append(f"line {line}: user '{username}' already on line {seen[username]}")
+        if r.get('email') and not EMAIL.fullmatch(r['email']):
+            errors.append(f"line {line}: '{r['email']}' is not an email address")
+        seen.setdefault(username, line)
+        learners.append({
+            'user': username,
+            'name': r.get('name') or username.title(),
+            'email': r.get('email', ''),
+            'domain': r.get('domain', ''),
+            'learning_goal': r.get('learning_goal', ''),
+            'custom_instructions': r.get('custom_instructions', ''),
+        })
+    return learners, errors
+
+
+def add_tabs_requests(usernames, properties):
+    """addSheet + header updateCells requests for every missing learner tab. Sheet IDs are
+    chosen up front so the headers go in the same (atomic) batchUpdate as the tabs."""
+    next_id = max([p.get('sheetId', 0) for p in properties.values()] + [0]) + 1
+    header = {'values': [{'userEnteredValue': {'stringValue': h}} for h in KB_HEADERS]}
+    requests = []
+    for sheet_id, username in enumerate((u for u in usernames if u not in properties), start=next_id):
+        requests.append({'addSheet': {'properties': {
+            'sheetId': sheet_id, 'title': username,
+            'gridProperties': {'rowCount': 1000, 'columnCount': len(KB_HEADERS)}}}})
+        requests.append({'updateCells': {
+            'start': {'sheetId': sheet_id, 'rowIndex': 0, 'columnIndex': 0},
+            'rows': [header], 'fields': 'userEnteredValue'}})
+    return requests
+
+
+def write_state(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def cmd_add_users(csv_path):
+    """Add every learner in a CSV: one batchUpdate per shard for the tabs, one config append,
+    sharing with bounded concurrency and prompt files rendered in parallel. Safe to rerun."""
+    from concurrent.futures import ThreadPoolExecutor
+    load_env()
 
+    if not check_dependencies():
+        sys.exit(1)
 
-def generate_prompts(username, name, domain, goal, custom_instructions, sheet_id, creds_path, user_dir):
-    """Generate CLAUDE.md, GEMINI.md, AGENTS.md for a user"""
-    os.makedirs(user_dir, exist_ok=True)
+    if not os.path.exists(csv_path):
+        print(f"ERROR: File not found: {csv_path}")
+        sys.exit(1)
+
+    learners, errors = read_users_csv(csv_path)
+    if errors:
+        print(f"ERROR: {csv_path} has {len(errors)} problem(s), nothing was added:")
+        for e in errors:
+            print(f"  {e}")
+        print(f"Columns: {', '.join(ADD_USERS_COLUMNS)} ('user' is required)")
+        sys.exit(1)
+    if not learners:
+        print("No learners found in CSV.")
+        return
 
-    # Read template
+    sheet_id = get_sheet_id()
+    state_path = csv_path + '.state.json'
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+        print(f"Resuming from {state_path}")
+    except (OSError, ValueError):
+        state = {'shards': {}, 'shared': []}
+    start = time.perf_counter()
+
+    async def run():
+        async with get_async_client() as client:
+            config_values, shards_values = await asyncio.gather(client.values(sheet_id, 'config'),
+                                                                client.values(sheet_id, 'shards'))
+            users = to_records(config_values or [])
+            in_config = {u.get('user'): u for u in users}
+
+            # Route new learners to the least-loaded shard, as add-user does, and
+            # save the routing before anything is created
+            capacity = int(os.environ.get('ARUNI_SHARD_CAPACITY', SHARD_CAPACITY))
+            load = {shard_id: 0 for shard_id in shard_ids(shards_values or [])}
+            for u in users:
+                load[shard_of(u)] = load.get(shard_of(u), 0) + 1
+            routes, gc, primary = {}, None, None
+            for learner in learners:
+                username = learner['user']
+                if username in in_config:
+                    routes[username] = shard_of(in_config[username])
+                    continue
+                shard_id = state['shards'].get(username)
+                if shard_id is None:
+                    shard_id, n = min(load.items(), key=lambda kv: kv[1])
+                    if n >= capacity:
+                        if primary is None:
+                            gc, _ = await client.run(get_gspread_client)
+                            primary = await client.run(get_sheet, gc)
+                        shard_id = await client.run(create_shard, gc, primary)
+                        load[shard_id] = 0
+                    state['shards'][username] = shard_id
+                load[shard_id] = load.get(shard_id, 0) + 1
+                routes[username] = shard_id
+            write_state(state_path, state)
+
+            # Tabs and their headers: one batchUpdate per shard, all shards at once
+            groups = {}
+            for learner in learners:
+                groups.setdefault(routes[learner['user']], []).append(learner['user'])
+
+            async def add_tabs(shard_id, usernames):
+                spreadsheet_id = shard_id or sheet_id
+                requests = add_tabs_requests(usernames, await client.sheet_properties(spreadsheet_id))
+                if requests:
+                    await client.batch_update(spreadsheet_id, requests)
+                return len(requests) // 2
+
+            created = sum(await asyncio.gather(*(add_tabs(s, u) for s, u in groups.items())))
+
+            # Config rows, the routing map, in one append
+            joined_at = datetime.now().strftime('%Y-%m-%d %H:%M')
+            new_rows = [[u['user'], u['name'], u['email'], u['domain'], u['learning_goal'], joined_at,
+                         u['custom_instructions'], routes[u['user']]]
+                        for u in learners if u['user'] not in in_config]
+            if (config_values or [[]])[0][:len(CONFIG_HEADERS)] != CONFIG_HEADERS:
+                await client.write_ranges(sheet_id, [{'range': a1('config', 'A1'), 'values': [CONFIG_HEADERS]}])
+            if new_rows:
+                await client.append_values(sheet_id, 'config', new_rows)
+
+            # Share each learner's spreadsheet, a few at a time
+            share_limit = asyncio.Semaphore(SHARE_CONCURRENCY)
+            shared = set(state['shared'])
+
+            async def share(learner):
+                spreadsheet_id = routes[learner['user']] or sheet_id
+                async with share_limit:
+                    try:
+                        await client.request('POST', f"{DRIVE_API}/{spreadsheet_id}/permissions",
+                                             json={'type': 'user', 'role': 'writer',
+                                                   'emailAddress': learner['email']})
+                    except Exception as e:
+                        print(f"  NOTE: Could not auto-share with {learner['email']}: {e}")
+                        return 0
+                state['shared'].append(learner['user'])
+                write_state(state_path, state)
+                return 1
+
+            to_share = [u for u in learners if u['email'] and u['user'] not in shared]
+            shares = sum(await asyncio.gather(*(share(u) for u in to_share)))
+            return created, len(new_rows), shares, len(to_share)
+
+    created, appended, shares, to_share = asyncio.run(run())
+
+    parts = load_template()
+    with ThreadPoolExecutor(max_workers=REGENERATE_WORKERS) as pool:
+        written = [w for _, w in pool.map(lambda u: render_user_prompts(parts, u), learners) if w]
+
+    print(f"Onboarded {len(learners)} learner(s) from {csv_path} in {time.perf_counter() - start:.1f}s:")
+    print(f"  {created} tab(s) created, {appended} config row(s) added, "
+          f"{shares} of {to_share} share(s) done, {len(written)} prompt folder(s) written")
+    if shares < to_share:
+        print(f"  Rerun 'python3 setup.py add-users {csv_path}' to retry sharing")
+    print(f"  Prompt files are in {USERS_DIR}/<username>/")
+
+
+PROMPT_FILES = ['CLAUDE.md', 'GEMINI.md', 'AGENTS.md']
+PLACEHOLDER = re.compile(r'__(NAME|USERNAME|DOMAIN|GOAL|ARUNI_PY|CUSTOM_INSTRUCTIONS)__')
+REGENERATE_WORKERS = 16
+
+
+def load_template():
+    """Prompt template split once into literal text (even items) and placeholder names (odd items)"""
     with open(TEMPLATE_PATH) as f:
-        template = f.read()
+        return PLACEHOLDER.split(f.read())
+
 
-    # Fill in placeholders
+def render_prompt(parts, username, name, domain, goal, custom_instructions):
     custom_block = ""
     if custom_instructions:
         custom_block = f"\n## Domain-Specific Instructions\n\n{custom_instructions}\n"
-
-    aruni_py = os.path.join(ARUNI_DIR, 'aruni.py')
-    rendered = (template
-        .replace('__NAME__', name)
-        .replace('__USERNAME__', username)
-        .replace('__DOMAIN__', domain)
-        .replace('__GOAL__', goal)
-        .replace('__ARUNI_PY__', aruni_py)
-        .replace('__CUSTOM_INSTRUCTIONS__', custom_block))
-
-    # Write all three variants (same content, different filenames)
-    for filename in ['CLAUDE.md', 'GEMINI.md', 'AGENTS.md']:
+    values = {
+        'NAME': name,
+        'USERNAME': username,
+        'DOMAIN': domain,
+        'GOAL': goal,
+        'ARUNI_PY': os.path.join(ARUNI_DIR, 'aruni.py'),
+        'CUSTOM_INSTRUCTIONS': custom_block,
+    }
+    out = list(parts)
+    out[1::2] = [values[key] for key in parts[1::2]]
+    return ''.join(out)
+
+
+def write_prompts(user_dir, rendered):
+    """Write the prompt files (same content, different filenames), skipping any whose
+    content hash is unchanged; returns the filenames written"""
+    os.makedirs(user_dir, exist_ok=True)
+    data = rendered.encode('utf-8')
+    digest = hashlib.sha256(data).digest()
+    written = []
+    for filename in PROMPT_FILES:
         filepath = os.path.join(user_dir, filename)
-        with open(filepath, 'w') as f:
-            f.write(rendered)
+        try:
+            with open(filepath, 'rb') as f:
+                if hashlib.sha256(f.read()).digest() == digest:
+                    continue
+        except OSError:
+            pass
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        written.append(filename)
+    return written
+
+
+def render_user_prompts(parts, user):
+    """Render and write one config row's prompt files; returns (username, filenames written)"""
+    username = user['user']
+    rendered = render_prompt(
+        parts,
+        username,
+        user.get('name', username.title()),
+        user.get('domain', ''),
+        user.get('learning_goal', ''),
+        user.get('custom_instructions', ''))
+    return username, write_prompts(os.path.join(USERS_DIR, username), rendered)
+
 
+def generate_prompts(username, name, domain, goal, custom_instructions, sheet_id, creds_path, user_dir):
+    """Generate CLAUDE.md, GEMINI.md, AGENTS.md for a user"""
+    rendered = render_prompt(load_template(), username, name, domain, goal, custom_instructions)
+    write_prompts(user_dir, rendered)
     print(f"  Generated prompt files in {user_dir}/")
 
 
-def cmd_regenerate(username):
-    """Re-generate prompt files for an existing user"""
+def cmd_regenerate(*usernames):
+    """Re-generate prompt files for one or more existing users"""
     load_env()
 
     if not check_dependencies():
         sys.exit(1)
 
-    sh = get_sheet()
-    users = read_config_tab(sh)
-
-    user_data = None
-    for u in users:
-        if u.get('user') == username:
-            user_data = u
-            break
+    sheet_id = get_sheet_id()
+
+    async def run():
+        async with get_async_client() as client:
+            users = await read_config_async(client, sheet_id)
+            by_name = {u.get('user'): u for u in users}
+            missing = [name for name in usernames if name not in by_name]
+            if missing:
+                print(f"ERROR: User '{missing[0]}' not found in config tab")
+                print(f"Available users: {', '.join(u.get('user', '?') for u in users)}")
+                sys.exit(1)
+
+            parts = load_template()
+            results = await asyncio.gather(*(client.run(render_user_prompts, parts, by_name[name])
+                                             for name in usernames))
+            for username, written in results:
+                user_dir = os.path.join(USERS_DIR, username)
+                if written:
+                    print(f"Regenerated prompt files for '{username}' in {user_dir}/")
+                else:
+                    print(f"Prompt files for '{username}' already up to date")
+
+    asyncio.run(run())
+
+
+def cmd_regenerate_all():
+    """Re-render every learner's prompt files from one config read, writing only what changed"""
+    from concurrent.futures import ThreadPoolExecutor
+    load_env()
 
-    if not user_data:
-        print(f"ERROR: User '{username}' not found in config tab")
-        print(f"Available users: {', '.join(u.get('user', '?') for u in users)}")
+    if not check_dependencies():
         sys.exit(1)
 
-    sheet_id = os.environ.get('ARUNI_DB')
-    creds_path = os.environ.get('ARUNI_KEY_PATH', os.path.join(ARUNI_DIR, '.aruni.key'))
-    if not os.path.isabs(creds_path):
-        creds_path = os.path.join(ARUNI_DIR, creds_path)
+    sheet_id = get_sheet_id()
+    start = time.perf_counter()
 
-    user_dir = os.path.join(USERS_DIR, username)
-    generate_prompts(
-        username,
-        user_data.get('name', username.title()),
-        user_data.get('domain', ''),
-        user_data.get('learning_goal', ''),
-        user_data.get('custom_instructions', ''),
-        sheet_id,
-        creds_path,
-        user_dir
-    )
-    print(f"Regenerated prompt files for '{username}' in {user_dir}/")
+    async def read():
+        async with get_async_client() as client:
+            return await read_config_async(client, sheet_id)
+
+    users = [u for u in asyncio.run(read()) if u.get('user')]
+    parts = load_template()
+    with ThreadPoolExecutor(max_workers=REGENERATE_WORKERS) as pool:
+        results = list(pool.map(lambda u: render_user_prompts(parts, u), users))
+
+    changed = [(username, written) for username, written in results if written]
+    for username, written in changed:
+        print(f"  updated  {username:<20} {', '.join(written)}")
+    print(f"Regenerated {len(users)} learner(s) in {time.perf_counter() - start:.2f}s: "
+          f"{len(changed)} changed, {len(users) - len(changed)} unchanged")
 
 
 def cmd_status():
@@ -375,41 +757,94 @@ def cmd_status():
     if not check_dependencies():
         sys.exit(1)
 
-    sh = get_sheet()
-    users = read_config_tab(sh)
-    today = datetime.now().strftime('%Y-%m-%d')
+    sheet_id = get_sheet_id()
+
+    async def run():
+        async with get_async_client() as client:
+            users = await read_config_async(client, sheet_id)
+            summaries, rollups = await asyncio.gather(read_summaries_async(client, sheet_id, users),
+                                                      read_rollups_async(client, sheet_id, users))
+            return users, summaries, rollups
+
+    users, summaries, rollups = asyncio.run(run())
 
     if not users:
         print("No users found. Run 'python3 setup.py add-user' first.")
         return
 
-    sheet_id = os.environ.get('ARUNI_DB')
     print(f"Sheet: https://docs.google.com/spreadsheets/d/{sheet_id}")
+    shards = len(group_by_shard(users))
+    if shards > 1:
+        print(f"Shards: {shards}")
     print()
-    print(f"{'User':<15} {'Domain':<30} {'Total':<7} {'Due':<5} {'Low':<5} {'Med':<5} {'High':<5}")
-    print("-" * 75)
+    print(f"{'User':<15} {'Domain':<30} {'Total':<7} {'Due':<5} {'Low':<5} {'Med':<5} {'High':<5} "
+          f"{'Streak':<7} {'Wk min':<7}")
+    print("-" * 90)
 
+    this_week = week_key(datetime.now().date())
     for u in users:
         username = u.get('user', '')
         domain = u.get('domain', '')[:28]
-        try:
-            ws = sh.worksheet(username)
-            rows = ws.get_all_records()
-        except Exception:
+        if summaries.get(username) is None:
             print(f"{username:<15} {'(tab not found)':<30}")
             continue
 
-        total = len(rows)
-        due = sum(1 for r in rows if r.get('next_review') and str(r['next_review']) <= today)
-        low = sum(1 for r in rows if r.get('confidence') == 'Low')
-        med = sum(1 for r in rows if r.get('confidence') == 'Medium')
-        high = sum(1 for r in rows if r.get('confidence') == 'High')
+        total, due, low, med, high = summaries[username]
+        r = rollups.get(username) or empty_rollup(username)
+        streak = current_streak(r)
+        week_minutes = r['weeks'].get(this_week, [0, 0, 0])[1]
 
-        print(f"{username:<15} {domain:<30} {total:<7} {due:<5} {low:<5} {med:<5} {high:<5}")
+        print(f"{username:<15} {domain:<30} {total:<7} {due:<5} {low:<5} {med:<5} {high:<5} "
+              f"{streak:<7} {week_minutes:<7}")
 
     print()
 
 
+def cmd_rebuild_rollups():
+    """Recompute every learner's rollup row from the full sessions tab of their shard"""
+    load_env()
+
+    if not check_dependencies():
+        sys.exit(1)
+
+    sheet_id = get_sheet_id()
+
+    async def rebuild_shard(client, spreadsheet_id):
+        values = await client.values(spreadsheet_id, 'sessions') or []
+        rollups = {}
+        # cols: user date start_time end_time duration_minutes domain concepts_covered key_insights open_questions
+        ended = [r for r in values[1:] if len(r) > 3 and r[0] and r[1] and r[3]]
+        for r in sorted(ended, key=lambda r: (r[1], r[2])):
+            try:
+                day = datetime.strptime(r[1], '%Y-%m-%d').date()
+            except ValueError:
+                continue
+            minutes = int(r[4]) if len(r) > 4 and r[4].lstrip('-').isdigit() else 0
+            topics = r[6] if len(r) > 6 else ''
+            insights = r[7] if len(r) > 7 else ''
+            fold_session(rollups.setdefault(r[0], empty_rollup(r[0])), day, minutes,
+                         count_topics(topics), topics, insights)
+
+        if await client.values(spreadsheet_id, 'rollups') is None:
+            await client.add_sheet(spreadsheet_id, 'rollups', rows=max(len(rollups) + 1, 100),
+                                   cols=len(ROLLUP_HEADERS))
+        await client.replace_values(spreadsheet_id, 'rollups',
+                                    [ROLLUP_HEADERS] + [rollup_row(r) for r in rollups.values()])
+        return len(ended), len(rollups)
+
+    async def run():
+        async with get_async_client() as client:
+            shards = shard_ids(await client.values(sheet_id, 'shards') or [])
+            spreadsheet_ids = [shard_id or sheet_id for shard_id in shards]
+            return await asyncio.gather(*(rebuild_shard(client, s) for s in spreadsheet_ids))
+
+    results = asyncio.run(run())
+    sessions = sum(n for n, _ in results)
+    learners = sum(n for _, n in results)
+    print(f"Rebuilt rollups for {learners} learner(s) from {sessions} session(s) "
+          f"across {len(results)} shard(s)")
+
+
 def cmd_migrate(username, json_path):
     """Import concepts from a Notion export JSON into a user's tab"""
     load_env()
@@ -421,11 +856,16 @@ def cmd_migrate(username, json_path):
         print(f"ERROR: File not found: {json_path}")
         sys.exit(1)
 
-    sh = get_sheet()
+    import gspread
+
+    gc, _ = get_gspread_client()
+    sh = get_sheet(gc)
+    user = next((u for u in read_config_tab(sh) if u.get('user') == username), {})
 
+    shard = open_shard(gc, sh, shard_of(user))
     try:
-        ws = sh.worksheet(username)
-    except Exception:
+        ws = shard.worksheet(username)
+    except gspread.exceptions.WorksheetNotFound:
         print(f"ERROR: Tab '{username}' not found. Run 'python3 setup.py add-user' first.")
         sys.exit(1)
 
@@ -437,14 +877,29 @@ def cmd_migrate(username, json_path):
         print("No concepts found in export file.")
         return
 
+    explanations = [c.get('explanation', '') for c in concepts]
+    questions = [c.get('question', c.get('questions', '')) for c in concepts]
+    if catalog_enabled():
+        # One read of the key column and one append for all new entries;
+        # concepts someone in this shard already has reuse their entry
+        explanations = put_catalog(shard, [(c.get('domain', ''), c.get('topic', ''), e, q)
+                                           for c, e, q in zip(concepts, explanations, questions)])
+        questions = [''] * len(concepts)
+        print(f"Linked concepts to {len(set(explanations))} shared entry(ies) in the 'catalog' tab")
+    elif blobs_enabled():
+        # One read of the hash column and one append for all new blobs
+        explanations = put_blobs(shard, explanations)
+        print("Stored explanations in the 'blobs' tab")
+
     rows_to_add = []
-    for c in concepts:
+    for c, explanation, question in zip(concepts, explanations, questions):
         rows_to_add.append([
             c.get('topic', ''),
             c.get('domain', ''),
-            c.get('explanation', ''),
-            c.get('question', c.get('questions', '')),
+            explanation,
+            question,
             c.get('confidence', 'Low'),
+            c.get('created_at', ''),
             c.get('last_reviewed', ''),
             c.get('next_review', ''),
             c.get('times_reviewed', 0)
@@ -458,19 +913,288 @@ def cmd_migrate(username, json_path):
         print("No concepts to import.")
 
 
+def cmd_add_shard():
+    """Create an extra spreadsheet that add-user can route new learners to"""
+    load_env()
+
+    if not check_dependencies():
+        sys.exit(1)
+
+    gc, _ = get_gspread_client()
+    sh = get_sheet(gc)
+    shard_id = create_shard(gc, sh)
+    print(f"Shards now: {len(list_shards(sh))}")
+    print(f"New learners go to the least-loaded shard (capacity "
+          f"{os.environ.get('ARUNI_SHARD_CAPACITY', SHARD_CAPACITY)} per shard).")
+    return shard_id
+
+
+# ---------------------------------------------------------------------------
+# Backup
+# ---------------------------------------------------------------------------
+
+# Each export is a directory backups/<stamp>/ with one gzipped NDJSON file per
+# tab (<spreadsheet id>/<tab>.ndjson.gz, lines are [row_number, values]) and an
+# export.json listing every tab's size. backups/manifest.json.gz keeps a short
+# hash of every row as of the last export, so an incremental export only
+# writes rows whose hash changed. Restore replays the chain back to the last
+# full export.
+BACKUP_DIR = os.path.join(ARUNI_DIR, 'backups')
+EXPORT_CHUNKS_IN_FLIGHT = 4         # batchGet calls (of BATCH_GET_RANGES tabs) held in memory at once
+RESTORE_CHUNK_CELLS = 100000        # cells per values:batchUpdate call
+
+
+def row_hash(row):
+    data = json.dumps(row, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+def backup_file(snapshot, spreadsheet_id, tab):
+    return os.path.join(snapshot, spreadsheet_id, quote(tab, safe='') + '.ndjson.gz')
+
+
+def read_gz_json(path):
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_gz_json(path, data):
+    tmp = path + '.tmp'
+    with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def cmd_export(full=False, backup_dir=BACKUP_DIR):
+    """Stream every tab of every shard to compressed NDJSON, writing only changed rows unless full"""
+    load_env()
+
+    if not check_dependencies():
+        sys.exit(1)
+
+    sheet_id = get_sheet_id()
+    start = time.perf_counter()
+    manifest_path = os.path.join(backup_dir, 'manifest.json.gz')
+    manifest = None if full else read_gz_json(manifest_path)
+    old_hashes = manifest['tabs'] if manifest else {}
+    # Claim a fresh directory: a second export in the same second gets -02, -03, ...
+    base_stamp = stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    os.makedirs(backup_dir, exist_ok=True)
+    for n in range(2, 100):
+        try:
+            os.mkdir(os.path.join(backup_dir, stamp))
+            break
+        except FileExistsError:
+            stamp = f'{base_stamp}-{n:02d}'
+    else:
+        print(f"ERROR: Too many exports in {backup_dir}/ this second; try again")
+        sys.exit(1)
+    snapshot = os.path.join(backup_dir, stamp)
+    info = {'stamp': stamp, 'base': manifest['latest'] if manifest else None,
+            'primary': sheet_id, 'tabs': {}}
+    new_hashes = {}
+
+    def write_tabs(spreadsheet_id, tabs):
+        """Compare and write one batch of tabs; runs on the client's thread pool"""
+        for tab, values in tabs.items():
+            key = f'{spreadsheet_id}/{tab}'
+            old = old_hashes.get(key, [])
+            hashes, changed, cols, out = [], 0, 0, None
+            for i, row in enumerate(values or []):
+                h = row_hash(row)
+                hashes.append(h)
+                cols = max(cols, len(row))
+                if i < len(old) and old[i] == h:
+                    continue
+                if out is None:
+                    out = gzip.open(backup_file(snapshot, spreadsheet_id, tab), 'wt', encoding='utf-8')
+                out.write(json.dumps([i + 1, row], ensure_ascii=False, separators=(',', ':')) + '\n')
+                changed += 1
+            if out is not None:
+                out.close()
+            new_hashes[key] = hashes
+            info['tabs'][key] = {'rows': len(hashes), 'cols': cols, 'changed': changed}
+
+    async def export_spreadsheet(client, spreadsheet_id):
+        os.makedirs(os.path.join(snapshot, spreadsheet_id), exist_ok=True)
+        titles = list(await client.sheet_properties(spreadsheet_id))
+        limit = asyncio.Semaphore(EXPORT_CHUNKS_IN_FLIGHT)
+
+        async def chunk(names):
+            async with limit:
+                tabs = await client.batch_values(spreadsheet_id, names, 'A:ZZ')
+                await client.run(write_tabs, spreadsheet_id, tabs)
+
+        await asyncio.gather(*(chunk(titles[i:i + BATCH_GET_RANGES])
+                               for i in range(0, len(titles), BATCH_GET_RANGES)))
+
+    async def run():
+        async with get_async_client() as client:
+            shards = shard_ids(await client.values(sheet_id, 'shards') or [])
+            await asyncio.gather(*(export_spreadsheet(client, s or sheet_id) for s in shards))
+
+    asyncio.run(run())
+    with open(os.path.join(snapshot, 'export.json'), 'w') as f:
+        json.dump(info, f, indent=1)
+    write_gz_json(manifest_path, {'latest': stamp, 'tabs': new_hashes})
+
+    rows = sum(t['rows'] for t in info['tabs'].values())
+    changed = sum(t['changed'] for t in info['tabs'].values())
+    size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(snapshot) for f in files)
+    kind = 'Full' if info['base'] is None else f"Incremental (since {info['base']})"
+    print(f"{kind} export {stamp}: {len(info['tabs'])} tab(s), {rows} row(s), {changed} written, "
+          f"{size / 1024:.0f} KB in {time.perf_counter() - start:.1f}s")
+    print(f"  {snapshot}/")
+
+
+def export_chain(backup_dir, stamp):
+    """Export infos from the last full export up to `stamp`, oldest first"""
+    chain, seen = [], set()
+    while stamp:
+        if stamp in seen:
+            raise ValueError(f"export {stamp} is its own base; the chain in {backup_dir}/ is broken")
+        seen.add(stamp)
+        try:
+            with open(os.path.join(backup_dir, stamp, 'export.json')) as f:
+                info = json.load(f)
+        except (OSError, ValueError) as e:
+            needed = f" (the base of {chain[-1]['stamp']})" if chain else ''
+            raise ValueError(f"export {stamp}{needed} is missing or unreadable in {backup_dir}/: {e}")
+        chain.append(info)
+        stamp = info['base']
+    return chain[::-1]
+
+
+def restored_rows(backup_dir, chain, key):
+    """A tab's rows as of the last export in the chain"""
+    spreadsheet_id, _, tab = key.partition('/')
+    rows = {}
+    for info in chain:
+        if key not in info['tabs']:
+            rows = {}       # tab didn't exist at that export
+            continue
+        path = backup_file(os.path.join(backup_dir, info['stamp']), spreadsheet_id, tab)
+        if os.path.exists(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    n, row = json.loads(line)
+                    rows[n] = row
+    n = chain[-1]['tabs'][key]['rows']
+    return [rows.get(i, []) for i in range(1, n + 1)]
+
+
+def cmd_restore(stamp=None, backup_dir=BACKUP_DIR, yes=False):
+    """Write an export back to the spreadsheets it came from, in chunked batch calls"""
+    load_env()
+
+    if not check_dependencies():
+        sys.exit(1)
+
+    if not stamp:
+        manifest = read_gz_json(os.path.join(backup_dir, 'manifest.json.gz'))
+        stamp = manifest and manifest['latest']
+    if not stamp or not os.path.exists(os.path.join(backup_dir, stamp, 'export.json')):
+        print(f"ERROR: No export {stamp or ''} in {backup_dir}/")
+        sys.exit(1)
+
+    try:
+        chain = export_chain(backup_dir, stamp)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    tabs = chain[-1]['tabs']
+    by_spreadsheet = {}
+    for key in tabs:
+        spreadsheet_id, _, tab = key.partition('/')
+        by_spreadsheet.setdefault(spreadsheet_id, []).append(tab)
+
+    print(f"Restoring export {stamp} ({len(chain)} export(s) in chain): {len(tabs)} tab(s) "
+          f"in {len(by_spreadsheet)} spreadsheet(s).")
+    print("This overwrites the current contents of those tabs.")
+    if not yes and input("Type 'restore' to continue: ").strip() != 'restore':
+        print("Cancelled.")
+        return
+
+    async def restore_spreadsheet(client, spreadsheet_id, titles):
+        # Make every tab exist and be big enough, then clear them all: two calls
+        props = await client.sheet_properties(spreadsheet_id)
+        resize = []
+        for tab in titles:
+            t = tabs[f'{spreadsheet_id}/{tab}']
+            rows, cols = max(t['rows'], 1), max(t['cols'], 1)
+            p = props.get(tab)
+            if p is None:
+                resize.append({'addSheet': {'properties': {
+                    'title': tab, 'gridProperties': {'rowCount': rows, 'columnCount': cols}}}})
+                continue
+            grid = p.get('gridProperties', {})
+            if grid.get('rowCount', 0) < rows or grid.get('columnCount', 0) < cols:
+                resize.append({'updateSheetProperties': {
+                    'properties': {'sheetId': p['sheetId'], 'gridProperties': {
+                        'rowCount': max(rows, grid.get('rowCount', 0)),
+                        'columnCount': max(cols, grid.get('columnCount', 0))}},
+                    'fields': 'gridProperties(rowCount,columnCount)'}})
+        if resize:
+            await client.batch_update(spreadsheet_id, resize)
+        await client.clear_ranges(spreadsheet_id, [a1(tab, 'A:ZZ') for tab in titles])
+
+        # Rebuild one tab at a time, packing blocks into calls of ~RESTORE_CHUNK_CELLS cells
+        data, cells, calls, written = [], 0, 0, 0
+        for tab in titles:
+            values = await client.run(restored_rows, backup_dir, chain, f'{spreadsheet_id}/{tab}')
+            start = 0
+            while start < len(values):
+                end, block_cells = start, 0
+                while end < len(values) and cells + block_cells < RESTORE_CHUNK_CELLS:
+                    block_cells += max(len(values[end]), 1)
+                    end += 1
+                data.append({'range': a1(tab, f'A{start + 1}'), 'values': values[start:end]})
+                cells += block_cells
+                written += end - start
+                start = end
+                if cells >= RESTORE_CHUNK_CELLS:
+                    await client.write_ranges(spreadsheet_id, data)
+                    data, cells, calls = [], 0, calls + 1
+        if data:
+            await client.write_ranges(spreadsheet_id, data)
+            calls += 1
+        return written, calls
+
+    async def run():
+        async with get_async_client() as client:
+            return await asyncio.gather(*(restore_spreadsheet(client, s, t)
+                                          for s, t in by_spreadsheet.items()))
+
+    results = asyncio.run(run())
+    print(f"Restored {sum(w for w, _ in results)} row(s) in {sum(c for _, c in results)} write call(s).")
+
+
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
+SETUP_COMMANDS = ('init', 'add-user', 'add-users', 'regenerate', 'regenerate-all', 'status', 'migrate',
+                  'add-shard', 'rebuild-rollups', 'export', 'restore')
+
+
 def print_help():
     print("Aruni Learning System - Setup")
     print()
     print("Usage:")
     print("  python3 setup.py init                  Create data store (first time)")
     print("  python3 setup.py add-user              Add a new learner (interactive)")
-    print("  python3 setup.py regenerate <user>     Re-generate prompt files")
+    print("  python3 setup.py add-users <file.csv>  Add learners in bulk from a CSV")
+    print("  python3 setup.py regenerate <user>..   Re-generate prompt files")
+    print("  python3 setup.py regenerate-all        Re-generate every user's prompt files")
     print("  python3 setup.py status                Show all users and stats")
     print("  python3 setup.py migrate <user> <file> Import from Notion export JSON")
+    print("  python3 setup.py add-shard             Add a spreadsheet for more learners")
+    print("  python3 setup.py rebuild-rollups       Recompute session rollups")
+    print("  python3 setup.py export [--full]       Back up every tab to backups/")
+    print("  python3 setup.py restore [stamp]       Restore a backup (default: latest)")
     print()
     print("First time? Run these in order:")
     print("  1. pip install gspread google-auth")
@@ -486,26 +1210,49 @@ if __name__ == '__main__':
 
     command = sys.argv[1]
 
-    if command == 'init':
-        cmd_init()
-    elif command == 'add-user':
-        cmd_add_user()
-    elif command == 'regenerate':
-        if len(sys.argv) < 3:
-            print("Usage: python3 setup.py regenerate <username>")
+    label = command if command in SETUP_COMMANDS else 'other'
+    with track_command('setup', label):
+        if command == 'init':
+            cmd_init()
+        elif command == 'add-user':
+            cmd_add_user()
+        elif command == 'add-users':
+            if len(sys.argv) < 3:
+                print("Usage: python3 setup.py add-users <learners.csv>")
+                print(f"  CSV columns: {', '.join(ADD_USERS_COLUMNS)} ('user' is required)")
+                sys.exit(1)
+            cmd_add_users(sys.argv[2])
+        elif command == 'regenerate':
+            if len(sys.argv) < 3:
+                print("Usage: python3 setup.py regenerate <username> [<username> ...]")
+                sys.exit(1)
+            cmd_regenerate(*sys.argv[2:])
+        elif command == 'regenerate-all':
+            cmd_regenerate_all()
+        elif command == 'status':
+            cmd_status()
+        elif command == 'migrate':
+            if len(sys.argv) < 4:
+                print("Usage: python3 setup.py migrate <username> <notion_export.json>")
+                sys.exit(1)
+            cmd_migrate(sys.argv[2], sys.argv[3])
+        elif command == 'add-shard':
+            cmd_add_shard()
+        elif command == 'rebuild-rollups':
+            cmd_rebuild_rollups()
+        elif command == 'export':
+            args = sys.argv[2:]
+            backup_dir = args[args.index('--dir') + 1] if '--dir' in args else BACKUP_DIR
+            cmd_export('--full' in args, backup_dir)
+        elif command == 'restore':
+            args = sys.argv[2:]
+            backup_dir = args[args.index('--dir') + 1] if '--dir' in args else BACKUP_DIR
+            stamps = [a for a in args if not a.startswith('--') and a != backup_dir]
+            cmd_restore(stamps[0] if stamps else None, backup_dir, '--yes' in args)
+        elif command in ['help', '--help', '-h']:
+            print_help()
+        else:
+            print(f"Unknown command: {command}")
+            print()
+            print_help()
             sys.exit(1)
-        cmd_regenerate(sys.argv[2])
-    elif command == 'status':
-        cmd_status()
-    elif command == 'migrate':
-        if len(sys.argv) < 4:
-            print("Usage: python3 setup.py migrate <username> <notion_export.json>")
-            sys.exit(1)
-        cmd_migrate(sys.argv[2], sys.argv[3])
-    elif command in ['help', '--help', '-h']:
-        print_help()
-    else:
-        print(f"Unknown command: {command}")
-        print()
-        print_help()
-        sys.exit(1)